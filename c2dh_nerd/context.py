@@ -1,27 +1,65 @@
 import os
+import asyncio
+import importlib
 import tempfile
 import logging
+from collections import OrderedDict
 from typing import Callable
 from diskcache import Cache
 
-from .ner.flair import FlairNer
-from .ner.spacy import SpacyNer
-from .ner.allennlp import AllenNlpNer
-from .ned.opentapioca import OpenTapiocaNed
-from .ned.gkg import GoogleKnowledgeGraphNed
-from .ned.fusion import FusionNed
+from .ner.cache import CachedNer
+from .ned.gkg import DEFAULT_EXPIRATION_SEC
 from .entities.store import EntitiesSetsStore
-from .ned.custom import CustomEntitiesSourceNed
+from .util.executor import InferenceExecutor
+from .util.http import HttpClient
+from .util.cache import LruCache, TieredCache
+from .util.limiter import RateLimiter
+from .util.registry import ModelRegistry
 
-def lazy_factory(tag: str, app: dict, constructor: Callable[[], object]):
-  def factory():
-    instance_tag = '{}__instance'.format(tag)
-    if instance_tag not in app:
-      app[instance_tag] = constructor()
-    return app[instance_tag]
-  return factory
+def lazy_class(module: str, name: str):
+  '''
+  Constructor of a class imported on first call, so that importing this
+  module does not import the libraries of every backend (torch, flair,
+  spacy, allennlp).
+  '''
+  def constructor(*args, **kwargs):
+    cls = getattr(importlib.import_module(module, __package__), name)
+    return cls(*args, **kwargs)
+  return constructor
 
-def get_cache():
+FlairNer = lazy_class('.ner.flair', 'FlairNer')
+SpacyNer = lazy_class('.ner.spacy', 'SpacyNer')
+AllenNlpNer = lazy_class('.ner.allennlp', 'AllenNlpNer')
+OpenTapiocaNed = lazy_class('.ned.opentapioca', 'OpenTapiocaNed')
+GoogleKnowledgeGraphNed = lazy_class('.ned.gkg', 'GoogleKnowledgeGraphNed')
+FusionNed = lazy_class('.ned.fusion', 'FusionNed')
+WikidataNed = lazy_class('.ned.wikidata', 'WikidataNed')
+CustomEntitiesSourceNed = lazy_class('.ned.custom', 'CustomEntitiesSourceNed')
+CustomEntitiesGazetteerNed = lazy_class('.ned.custom', 'CustomEntitiesGazetteerNed')
+
+def add_model(app: dict, tag: str, constructor: Callable[[], object], evictable: bool = False):
+  '''
+  Register a NER or NED. `app[tag]()` returns its instance, created on first use.
+  '''
+  app['models'].register(tag, constructor, evictable)
+  app[tag] = app['models'].factory(tag)
+
+def optional_float(name: str):
+  value = os.environ.get(name)
+  return float(value) if value not in [None, ''] else None
+
+def get_model_registry():
+  '''
+  NER models are evicted when they take more than `MODELS_MEMORY_BUDGET_MB`
+  altogether or have not been used for `MODELS_IDLE_TTL_SEC`.
+  '''
+  memory_budget_mb = optional_float('MODELS_MEMORY_BUDGET_MB')
+  return ModelRegistry(
+    memory_budget = int(memory_budget_mb * 1024 * 1024) if memory_budget_mb is not None else None,
+    idle_ttl_sec = optional_float('MODELS_IDLE_TTL_SEC')
+  )
+
+def get_cache_dir():
   default_tempdir = os.path.join(tempfile.gettempdir(), 'c2dh_nerd_cache')
   try:
     os.mkdir(default_tempdir)
@@ -29,51 +67,237 @@ def get_cache():
     pass
 
   cache_location = os.path.realpath(os.environ.get('CACHE_DIR', default_tempdir))
-  logging.debug('Using "{}" as cache location'.format(cache_location))
   assert os.path.isdir(cache_location), 'Cache directory does not exist'
+  return cache_location
+
+def get_cache():
+  cache_location = get_cache_dir()
+  logging.debug('Using "{}" as cache location'.format(cache_location))
   return Cache(cache_location)
 
+def get_entities_index_dir():
+  '''
+  Built entities sets indexes are kept in `ENTITIES_INDEX_DIR`
+  or in "entities_sets" in the cache directory.
+  '''
+  return os.path.realpath(os.environ.get('ENTITIES_INDEX_DIR', os.path.join(get_cache_dir(), 'entities_sets')))
+
+def get_ned_cache(disk_cache: Cache):
+  '''
+  Parsed NED responses kept in memory in front of the disk cache.
+  '''
+  memory_budget_mb = float(os.environ.get('NED_MEMORY_CACHE_MB', 64))
+  memory_cache = LruCache(int(memory_budget_mb * 1024 * 1024), ttl_sec = DEFAULT_EXPIRATION_SEC)
+  return TieredCache(disk_cache, memory_cache, expire_sec = DEFAULT_EXPIRATION_SEC)
+
+def get_inference_executor():
+  '''
+  Every NER model gets its own executor so that a slow model
+  does not hold up requests to the other ones.
+  '''
+  return InferenceExecutor(
+    kind = os.environ.get('INFERENCE_EXECUTOR', 'thread'),
+    max_workers = int(os.environ.get('INFERENCE_WORKERS', 1)),
+    max_queue_size = int(os.environ.get('INFERENCE_QUEUE_SIZE', 16))
+  )
+
+def get_http_client():
+  return HttpClient(
+    limit = int(os.environ.get('HTTP_CONNECTION_LIMIT', 100)),
+    limit_per_host = int(os.environ.get('HTTP_CONNECTION_LIMIT_PER_HOST', 16)),
+    timeout_sec = float(os.environ.get('HTTP_TIMEOUT_SEC', 30)),
+    keepalive_timeout_sec = float(os.environ.get('HTTP_KEEPALIVE_TIMEOUT_SEC', 30))
+  )
+
+def get_gkg_limiter():
+  '''
+  Limits of calls to the Google Knowledge Graph API, shared by all requests.
+  '''
+  return RateLimiter(
+    max_in_flight = int(os.environ.get('GKG_MAX_IN_FLIGHT', 8)),
+    rate_per_sec = optional_float('GKG_RATE_PER_SEC'),
+    burst = int(os.environ.get('GKG_RATE_BURST', 10)),
+    backoff_base_sec = float(os.environ.get('GKG_BACKOFF_BASE_SEC', 0.5)),
+    backoff_max_sec = float(os.environ.get('GKG_BACKOFF_MAX_SEC', 30))
+  )
+
+def with_ner_cache(tag: str, app: dict, constructor: Callable[[], object]):
+  '''
+  Wrap NER in a result cache if `NER_CACHE` is set to 1.
+  '''
+  if str(os.environ.get('NER_CACHE', '')) != '1':
+    return constructor
+  expire_sec = float(os.environ.get('NER_CACHE_EXPIRATION_SEC', DEFAULT_EXPIRATION_SEC))
+  return lambda: CachedNer(constructor(), tag, app['cache'], expire_sec)
+
+def get_flair_ner(model_name: str = 'ner-fast'):
+  sentence_cache_mb = float(os.environ.get('FLAIR_SENTENCE_CACHE_MB', 16))
+  sentence_cache = LruCache(int(sentence_cache_mb * 1024 * 1024)) if sentence_cache_mb > 0 else None
+
+  return FlairNer(
+    model_name,
+    executor = get_inference_executor(),
+    max_batch_size = int(os.environ.get('FLAIR_BATCH_SIZE', 32)),
+    max_batch_wait_ms = float(os.environ.get('FLAIR_BATCH_WAIT_MS', 5)),
+    sentence_cache = sentence_cache
+  )
+
+def get_opentapioca_ned(app: dict):
+  '''
+  Mentions of a document disambiguated by a fusion NED are annotated
+  `OPENTAPIOCA_BATCH_SIZE` at a time.
+  '''
+  return OpenTapiocaNed(
+    http_client = app['http_client'],
+    cache = app['ned_cache'],
+    max_batch_size = int(os.environ.get('OPENTAPIOCA_BATCH_SIZE', 16)),
+    max_batch_wait_ms = float(os.environ.get('OPENTAPIOCA_BATCH_WAIT_MS', 5))
+  )
+
+def get_fusion_ned(ners, neds, gazetteer = None):
+  '''
+  Fusion NED scheduling is configured for all NEDs with
+  `FUSION_NED_DEADLINE_SEC`, `FUSION_NED_MAX_CONCURRENCY` and
+  `FUSION_NED_SPECULATIVE_DELAY_SEC`. Unset means no limit.
+  Repeated mentions are disambiguated once, per tag if
+  `FUSION_NED_GROUP_BY_TAG` is set to 1.
+  '''
+  max_concurrency = os.environ.get('FUSION_NED_MAX_CONCURRENCY')
+  return FusionNed(
+    ners,
+    neds,
+    gazetteer = gazetteer,
+    deadline_sec = optional_float('FUSION_NED_DEADLINE_SEC'),
+    max_concurrency = int(max_concurrency) if max_concurrency not in [None, ''] else None,
+    speculative_delay_sec = optional_float('FUSION_NED_SPECULATIVE_DELAY_SEC'),
+    group_by_tag = str(os.environ.get('FUSION_NED_GROUP_BY_TAG', '')) == '1'
+  )
+
 def add_context(app: dict):
   # cache
   app['cache'] = get_cache()
+  app['ned_cache'] = get_ned_cache(app['cache'])
+
+  # HTTP client shared by everything talking to remote services
+  app['http_client'] = get_http_client()
+  # limits of calls to remote services by name
+  app['limiters'] = { 'gkg': get_gkg_limiter() }
 
   # Entities store
-  app['entities_store'] = EntitiesSetsStore()
+  refresh_interval_sec = float(os.environ.get('ENTITIES_REFRESH_INTERVAL_SEC', 0))
+  app['entities_store'] = EntitiesSetsStore(
+    http_client = app['http_client'],
+    index_dir = get_entities_index_dir(),
+    refresh_interval_sec = refresh_interval_sec if refresh_interval_sec > 0 else None,
+    max_rows = int(os.environ.get('ENTITIES_MAX_ROWS', 10 * 1000 * 1000)),
+    max_bytes = int(os.environ.get('ENTITIES_MAX_BYTES', 2 * 1024 * 1024 * 1024)),
+    allow_files = str(os.environ.get('ENTITIES_ALLOW_FILE_URLS', '')) == '1'
+  )
 
   # NED/NER
-  app['ner_flair'] = lazy_factory('ner_flair', app, FlairNer)
+  app['models'] = get_model_registry()
+  add_model(app, 'ner_flair', with_ner_cache('ner_flair', app, get_flair_ner), evictable=True)
 
-  app['ner_flair_en'] = lazy_factory('ner_flair', app, lambda: FlairNer('ner-ontonotes'))
-  app['ner_flair_fr'] = lazy_factory('ner_flair', app, lambda: FlairNer('fr-ner'))
-  app['ner_flair_de'] = lazy_factory('ner_flair', app, lambda: FlairNer('de-ner'))
+  add_model(app, 'ner_flair_en', with_ner_cache('ner_flair_en', app, lambda: get_flair_ner('ner-ontonotes')), evictable=True)
+  add_model(app, 'ner_flair_fr', with_ner_cache('ner_flair_fr', app, lambda: get_flair_ner('fr-ner')), evictable=True)
+  add_model(app, 'ner_flair_de', with_ner_cache('ner_flair_de', app, lambda: get_flair_ner('de-ner')), evictable=True)
 
-  app['ner_spacy_small_en'] = lazy_factory('ner_spacy_small_en', app, lambda: SpacyNer('small_en'))
-  app['ner_spacy_small_multi'] = lazy_factory('ner_spacy_small_multi', app, lambda: SpacyNer('small_multi'))
-  # app['ner_spacy_large_en'] = lazy_factory('ner_spacy_large_en', app, lambda: SpacyNer('large_en'))
+  add_model(app, 'ner_spacy_small_en', with_ner_cache('ner_spacy_small_en', app, lambda: SpacyNer('small_en', executor=get_inference_executor())), evictable=True)
+  add_model(app, 'ner_spacy_small_multi', with_ner_cache('ner_spacy_small_multi', app, lambda: SpacyNer('small_multi', executor=get_inference_executor())), evictable=True)
+  # add_model(app, 'ner_spacy_large_en', lambda: SpacyNer('large_en', executor=get_inference_executor()), evictable=True)
 
-  app['ner_allennlp_finegrained'] = lazy_factory('ner_allennlp_finegrained', app, lambda: AllenNlpNer('fine-grained-ner'))
+  add_model(app, 'ner_allennlp_finegrained', with_ner_cache('ner_allennlp_finegrained', app, lambda: AllenNlpNer('fine-grained-ner', executor=get_inference_executor())), evictable=True)
 
-  app['ned_opentapioca'] = lazy_factory('ned_opentapioca', app, OpenTapiocaNed)
-  app['ned_gkg'] = lazy_factory('ned_gkg', app, lambda: GoogleKnowledgeGraphNed(cache=app['cache']))
-  app['ned_custom_entities'] = lazy_factory('ned_custom_entities', app, lambda: CustomEntitiesSourceNed(app['entities_store']))
+  add_model(app, 'ned_opentapioca', lambda: get_opentapioca_ned(app))
+  add_model(app, 'ned_gkg', lambda: GoogleKnowledgeGraphNed(cache=app['ned_cache'], http_client=app['http_client'], limiter=app['limiters']['gkg']))
+  add_model(app, 'ned_wikidata', lambda: WikidataNed(os.environ.get('WIKIDATA_INDEX_PATH')))
+  add_model(app, 'ned_custom_entities', lambda: CustomEntitiesSourceNed(app['entities_store']))
+  add_model(app, 'ned_custom_entities_gazetteer', lambda: CustomEntitiesGazetteerNed(app['entities_store']))
 
-  # app['ned_fusion-spacy_large_en-gkg'] = lazy_factory('ned_gkg', app, lambda: FusionNed([app['ner_spacy_large_en']()], [app['ned_gkg']()]))
-  app['ned_fusion-flair-gkg'] = lazy_factory('ned_gkg', app, lambda: FusionNed([app['ner_flair']()], [app['ned_gkg']()]))
-  app['ned_fusion-flair-custom_entities'] = lazy_factory('ned_fusion-flair-custom_entities', app, lambda: FusionNed([app['ner_flair']()], [app['ned_custom_entities']()]))
-  app['ned_fusion-flair-custom_entities-gkg'] = lazy_factory('ned_fusion-flair-custom_entities', app, lambda: FusionNed([app['ner_flair']()], [app['ned_custom_entities'](), app['ned_gkg']()]))
+  # add_model(app, 'ned_fusion-spacy_large_en-gkg', lambda: get_fusion_ned([app['ner_spacy_large_en']()], [app['ned_gkg']()]))
+  add_model(app, 'ned_fusion-flair-gkg', lambda: get_fusion_ned([app['ner_flair']()], [app['ned_gkg']()]))
+  add_model(app, 'ned_fusion-flair-opentapioca', lambda: get_fusion_ned([app['ner_flair']()], [app['ned_opentapioca']()]))
+  add_model(app, 'ned_fusion-flair-wikidata', lambda: get_fusion_ned([app['ner_flair']()], [app['ned_wikidata']()]))
+  add_model(app, 'ned_fusion-flair-custom_entities', lambda: get_fusion_ned([app['ner_flair']()], [app['ned_custom_entities']()]))
+  add_model(app, 'ned_fusion-flair-custom_entities-gkg', lambda: get_fusion_ned([app['ner_flair']()], [app['ned_custom_entities'](), app['ned_gkg']()]))
 
-  app['ned_fusion-flair-custom_entities-fr'] = lazy_factory('ned_fusion-flair-custom_entities-fr', app, lambda: FusionNed([app['ner_flair_fr']()], [app['ned_custom_entities']()]))
-  app['ned_fusion-flair-custom_entities-de'] = lazy_factory('ned_fusion-flair-custom_entities-de', app, lambda: FusionNed([app['ner_flair_fr']()], [app['ned_custom_entities']()]))
+  add_model(app, 'ned_fusion-flair-custom_entities-wikidata-gkg', lambda: get_fusion_ned([app['ner_flair']()], [app['ned_custom_entities'](), app['ned_wikidata'](), app['ned_gkg']()]))
+  add_model(app, 'ned_fusion-custom_entities_gazetteer-flair-gkg', lambda: get_fusion_ned([app['ner_flair']()], [app['ned_gkg']()], gazetteer=app['ned_custom_entities_gazetteer']()))
+
+  add_model(app, 'ned_fusion-flair-custom_entities-fr', lambda: get_fusion_ned([app['ner_flair_fr']()], [app['ned_custom_entities']()]))
+  add_model(app, 'ned_fusion-flair-custom_entities-de', lambda: get_fusion_ned([app['ner_flair_fr']()], [app['ned_custom_entities']()]))
 
   return app
 
+def get_preload_tags():
+  return [t.strip() for t in os.environ.get('PRELOAD_MODELS', '').split(',') if t.strip() != '']
+
+async def preload_model(app: dict, tag: str):
+  readiness = app['readiness']
+  try:
+    readiness[tag] = 'loading'
+    instance = await app['models'].load(tag)
+    app['models'].pin(tag)
+    if hasattr(instance, 'warm_up'):
+      readiness[tag] = 'warming_up'
+      await instance.warm_up()
+    readiness[tag] = 'ready'
+  except Exception as err:
+    logging.exception('Could not preload model "{}"'.format(tag))
+    readiness[tag] = 'failed: {}'.format(err)
+
+async def start_preload(app: dict):
+  '''
+  Models listed in `PRELOAD_MODELS` (comma separated tags, e.g.
+  "ner_flair,ned_fusion-flair-gkg") are loaded in parallel in the
+  background when the app starts. NER models, including the NER of
+  fusion NEDs, are warmed up with one inference. Preloaded models are never evicted.
+  '''
+  tags = get_preload_tags()
+  for tag in tags:
+    assert tag in app['models'], 'Unknown model "{}" in PRELOAD_MODELS'.format(tag)
+
+  app['readiness'] = OrderedDict((tag, 'pending') for tag in tags)
+  app['preload'] = asyncio.ensure_future(asyncio.gather(*[preload_model(app, tag) for tag in tags]))
+
+def prepare_fork(app: dict):
+  '''
+  Called in the parent process before forking workers.
+
+  If `PRELOAD_BEFORE_FORK` is set to 1, models in `PRELOAD_MODELS` are
+  loaded here, without warm-up, so that workers share their weights
+  (copy-on-write) instead of loading them each. Warm-up runs in every
+  worker: inference before forking may leave thread pools (e.g. torch
+  OpenMP threads) that do not survive the fork.
+
+  Connections to the disk cache must not be shared between processes,
+  they are closed here and every worker opens its own. The cache
+  directory itself is safe to share.
+  '''
+  if str(os.environ.get('PRELOAD_BEFORE_FORK', '')) == '1':
+    for tag in get_preload_tags():
+      app['models'].get(tag)
+      app['models'].pin(tag)
+  app['cache'].close()
+
+def is_ready(app: dict) -> bool:
+  return all(
+    state == 'ready' and app['models'].is_loaded(tag)
+    for tag, state in app['readiness'].items()
+  )
+
+async def close_context(app: dict):
+  if 'preload' in app and not app['preload'].done():
+    app['preload'].cancel()
+  await app['http_client'].close()
+
 
-def get_data(tag):
+def get_data(tag = None):
   if str(os.environ.get('DOWNLOAD_MODELS', '')) == '1':
     from spacy.cli import download
-    if tag == 'ner_en_core_web_sm':
+    if tag in [None, 'ner_en_core_web_sm']:
       download('en_core_web_sm')
-    if tag == 'xx_ent_wiki_sm':
+    if tag in [None, 'xx_ent_wiki_sm']:
       download('xx_ent_wiki_sm')
     # download('en_core_web_lg')
 
@@ -0,0 +1,122 @@
+from array import array
+from typing import List
+
+# Share of the buffers taken by replaced or deleted values above which
+# they are rewritten by `compact`.
+MAX_DEAD_RATIO = 0.25
+
+class ColumnsStore:
+  '''
+  Rows of strings stored column by column.
+
+  Values of a column are kept UTF-8 encoded one after another in a single
+  buffer, with their offsets and lengths in arrays. A row costs a few
+  bytes per column on top of its text instead of a list and a string
+  object per value. Strings are only decoded when a row is read.
+
+  Rows shorter than `n_columns` are padded with empty strings,
+  longer ones are truncated. Deleted rows keep their position.
+
+  Replaced and deleted values stay in the buffers (`dead_bytes`) until
+  `compact` is called.
+  '''
+  def __init__(self, n_columns: int):
+    self.n_columns = n_columns
+    self._buffers = [bytearray() for _ in range(n_columns)]
+    self._offsets = [array('Q') for _ in range(n_columns)]
+    self._lengths = [array('I') for _ in range(n_columns)]
+    self._deleted = bytearray()
+    self.dead_bytes = 0
+
+  def __len__(self):
+    return len(self._deleted)
+
+  def _encode(self, column: int, value: str):
+    encoded = value.encode('utf-8')
+    buffer = self._buffers[column]
+    offset = len(buffer)
+    buffer += encoded
+    return offset, len(encoded)
+
+  def append(self, row: List[str]):
+    for column in range(self.n_columns):
+      value = row[column] if column < len(row) else ''
+      offset, length = self._encode(column, value)
+      self._offsets[column].append(offset)
+      self._lengths[column].append(length)
+    self._deleted.append(0)
+
+  def __setitem__(self, idx: int, row: List[str]):
+    '''
+    Replace a row or delete it if `row` is `None`.
+    The previous values stay in the buffers until the store is compacted.
+    '''
+    if not self.is_deleted(idx):
+      for column in range(self.n_columns):
+        self.dead_bytes += self._lengths[column][idx]
+
+    if row is None:
+      for column in range(self.n_columns):
+        self._offsets[column][idx] = 0
+        self._lengths[column][idx] = 0
+      self._deleted[idx] = 1
+      return
+
+    for column in range(self.n_columns):
+      value = row[column] if column < len(row) else ''
+      offset, length = self._encode(column, value)
+      self._offsets[column][idx] = offset
+      self._lengths[column][idx] = length
+    self._deleted[idx] = 0
+
+  def is_deleted(self, idx: int) -> bool:
+    return self._deleted[idx] == 1
+
+  def value(self, idx: int, column: int) -> str:
+    offset = self._offsets[column][idx]
+    length = self._lengths[column][idx]
+    return self._buffers[column][offset:offset + length].decode('utf-8')
+
+  def __getitem__(self, idx: int) -> List[str]:
+    if self.is_deleted(idx):
+      return None
+    return [self.value(idx, column) for column in range(self.n_columns)]
+
+  def __iter__(self):
+    for idx in range(len(self)):
+      yield self[idx]
+
+  @property
+  def size(self) -> int:
+    '''
+    Bytes used by the buffers, dead ones included.
+    '''
+    return sum(len(b) for b in self._buffers)
+
+  @property
+  def needs_compaction(self) -> bool:
+    return self.dead_bytes > 0 and self.dead_bytes >= self.size * MAX_DEAD_RATIO
+
+  def compact(self):
+    '''
+    Rewrite the buffers without replaced and deleted values.
+    Row positions do not change.
+    '''
+    for column in range(self.n_columns):
+      buffer = self._buffers[column]
+      offsets = self._offsets[column]
+      lengths = self._lengths[column]
+      new_buffer = bytearray()
+      for idx in range(len(self)):
+        offset = offsets[idx]
+        length = lengths[idx]
+        offsets[idx] = len(new_buffer)
+        new_buffer += buffer[offset:offset + length]
+      self._buffers[column] = new_buffer
+    self.dead_bytes = 0
+
+  def padded(self, row: List[str]) -> List[str]:
+    '''
+    `row` as it would be returned after being stored.
+    '''
+    return [row[column] if column < len(row) else '' for column in range(self.n_columns)]
@@ -0,0 +1,122 @@
+from collections import deque
+from typing import List, Tuple
+from .index import TOKEN_RE
+
+def tokenize_with_spans(text: str) -> List[Tuple[str, int, int]]:
+  '''
+  Lowercased tokens with their positions in `text`: `(token, left, right)`.
+  Unlike `tokenize`, stop words and single characters are kept: they are
+  part of the name being looked for.
+  '''
+  return [(m.group(0).lower(), m.start(), m.end()) for m in TOKEN_RE.finditer(text)]
+
+class Gazetteer:
+  '''
+  Aho-Corasick automaton over names, matched token by token. Names are
+  matched case insensitively on all their tokens, so "Bank of England"
+  is found in "the BANK OF ENGLAND's" but not in "bank in England".
+
+  A text is scanned once whatever the number of names: every name found
+  in it is reported with the documents it belongs to. Documents added
+  with a lower `priority` come first.
+  '''
+  def __init__(self):
+    # node -> token -> next node
+    self._goto = [{}]
+    self._fail = [0]
+    # number of tokens of the path to the node
+    self._depth = [0]
+    # (priority, doc id) of names ending in the node
+    self._entries = [None]
+    # doc ids of names ending in the node, ordered by priority
+    self._docs = [None]
+    # nearest node on the failure path where a name ends
+    self._output = [0]
+    self._built = True
+
+  def add(self, name: str, doc_id: int, priority: int = 0):
+    tokens = [token for token, _, _ in tokenize_with_spans(name)]
+    if len(tokens) == 0:
+      return
+
+    node = 0
+    for token in tokens:
+      next_node = self._goto[node].get(token)
+      if next_node is None:
+        next_node = len(self._goto)
+        self._goto.append({})
+        self._fail.append(0)
+        self._depth.append(self._depth[node] + 1)
+        self._entries.append(None)
+        self._docs.append(None)
+        self._output.append(0)
+        self._goto[node][token] = next_node
+      node = next_node
+
+    if self._entries[node] is None:
+      self._entries[node] = []
+    self._entries[node].append((priority, doc_id))
+    self._built = False
+
+  def build(self):
+    '''
+    Compute failure links. Called by `scan` if names were added since.
+    '''
+    for node, entries in enumerate(self._entries):
+      if entries is not None:
+        docs = []
+        for _, doc_id in sorted(entries):
+          if doc_id not in docs:
+            docs.append(doc_id)
+        self._docs[node] = docs
+
+    queue = deque(self._goto[0].values())
+    for node in queue:
+      self._fail[node] = 0
+      self._output[node] = 0
+
+    while len(queue) > 0:
+      node = queue.popleft()
+      for token, child in self._goto[node].items():
+        queue.append(child)
+        fail = self._fail[node]
+        while fail != 0 and token not in self._goto[fail]:
+          fail = self._fail[fail]
+        fail = self._goto[fail].get(token, 0)
+        self._fail[child] = fail
+        self._output[child] = fail if self._docs[fail] is not None else self._output[fail]
+
+    self._built = True
+
+  def scan(self, text: str) -> List[Tuple[int, int, List[int]]]:
+    '''
+    Names found in `text` as `(left, right, doc ids)`. Overlapping
+    matches are resolved by keeping the leftmost and then the longest one.
+    '''
+    if not self._built:
+      self.build()
+
+    tokens = tokenize_with_spans(text)
+
+    # (first token, last token, node)
+    matches = []
+    node = 0
+    for position, (token, _, _) in enumerate(tokens):
+      while node != 0 and token not in self._goto[node]:
+        node = self._fail[node]
+      node = self._goto[node].get(token, 0)
+
+      match_node = node if self._docs[node] is not None else self._output[node]
+      while match_node != 0:
+        matches.append((position - self._depth[match_node] + 1, position, match_node))
+        match_node = self._output[match_node]
+
+    matches.sort(key=lambda m: (m[0], -m[1]))
+
+    spans = []
+    last_token = -1
+    for first_token, end_token, match_node in matches:
+      if first_token > last_token:
+        spans.append((tokens[first_token][1], tokens[end_token][2], self._docs[match_node]))
+        last_token = end_token
+    return spans
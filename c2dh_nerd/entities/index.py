@@ -0,0 +1,246 @@
+import re
+import bisect
+from collections import defaultdict
+from typing import List, Tuple, Dict, Set
+
+# Tokenization and stop words match the Whoosh `StandardAnalyzer`
+# the entities sets were indexed with before.
+STOP_WORDS = frozenset([
+  'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'for', 'from',
+  'have', 'if', 'in', 'is', 'it', 'may', 'not', 'of', 'on', 'or', 'tbd',
+  'that', 'the', 'this', 'to', 'us', 'we', 'when', 'will', 'with', 'yet',
+  'you', 'your'
+])
+TOKEN_RE = re.compile(r'\w+(?:\.?\w+)*', re.UNICODE)
+MIN_TOKEN_LENGTH = 2
+
+# `term~`, `term~2` or `term~2/3` (max edit distance / prefix length) as in Whoosh `FuzzyTermPlugin`
+FUZZY_TERM_RE = re.compile(r'^(?P<term>\S+?)~(?P<maxdist>[0-9])?(?:/(?P<prefix>[1-9][0-9]*))?$')
+
+NGRAM_SIZE = 3
+
+# Whoosh scores a fuzzy term matching more than 2 terms of a field with
+# a constant score in indexes of at most this many documents.
+FUZZY_CONSTANT_SCORE_MAX_DOCS = 5000
+
+FIELDS = ['name', 'alternative_names']
+
+def tokenize(text: str) -> List[str]:
+  tokens = [m.group(0).lower() for m in TOKEN_RE.finditer(text)]
+  return [t for t in tokens if len(t) >= MIN_TOKEN_LENGTH and t not in STOP_WORDS]
+
+def normalize_name(text: str) -> str:
+  return ' '.join(tokenize(text))
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+  '''
+  Levenshtein distance between `a` and `b`.
+  Gives up and returns `max_distance + 1` as soon as it is exceeded.
+  '''
+  if abs(len(a) - len(b)) > max_distance:
+    return max_distance + 1
+
+  previous = list(range(len(b) + 1))
+  for i, ca in enumerate(a, 1):
+    current = [i]
+    for j, cb in enumerate(b, 1):
+      current.append(min(
+        previous[j] + 1,
+        current[j - 1] + 1,
+        previous[j - 1] + (ca != cb)
+      ))
+    if min(current) > max_distance:
+      return max_distance + 1
+    previous = current
+  return previous[-1]
+
+def ngrams(term: str) -> Set[str]:
+  padded = '\0' * (NGRAM_SIZE - 1) + term + '\0' * (NGRAM_SIZE - 1)
+  return set(padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1))
+
+def parse_query(query: str, allow_fuzzy: bool = True) -> List[tuple]:
+  '''
+  Query is a list of clauses that all have to match:
+   * `('term', term)`
+   * `('fuzzy', term, max_distance, prefix_length)`
+  '''
+  clauses = []
+  for word in query.split():
+    match = FUZZY_TERM_RE.match(word) if allow_fuzzy else None
+    if match is not None:
+      # fuzzy terms are not filtered for stop words
+      terms = [m.group(0).lower() for m in TOKEN_RE.finditer(match.group('term'))]
+      max_distance = int(match.group('maxdist') or 1)
+      prefix_length = int(match.group('prefix') or 0)
+      clauses += [('fuzzy', t, max_distance, prefix_length) for t in terms]
+    else:
+      clauses += [('term', t) for t in tokenize(word)]
+  return clauses
+
+class FuzzyTermsIndex:
+  '''
+  Trigram index over the vocabulary of a field.
+  Used to find candidate terms within an edit distance of a query term.
+  '''
+  def __init__(self, terms):
+    self._ngrams = defaultdict(set)
+    self._by_length = defaultdict(set)
+    for term in terms:
+      self.add(term)
+
+  def add(self, term: str):
+    self._by_length[len(term)].add(term)
+    for ngram in ngrams(term):
+      self._ngrams[ngram].add(term)
+
+  def similar(self, term: str, max_distance: int, prefix_length: int = 0) -> Set[str]:
+    term_ngrams = ngrams(term)
+    # Every edit changes at most NGRAM_SIZE ngrams.
+    min_shared = len(term_ngrams) - NGRAM_SIZE * max_distance
+
+    if min_shared > 0:
+      counts = defaultdict(int)
+      for ngram in term_ngrams:
+        for candidate in self._ngrams.get(ngram, ()):
+          counts[candidate] += 1
+      candidates = [c for c, count in counts.items() if count >= min_shared]
+    else:
+      candidates = [
+        c
+        for length in range(len(term) - max_distance, len(term) + max_distance + 1)
+        for c in self._by_length.get(length, ())
+      ]
+
+    prefix = term[:prefix_length]
+    return set(
+      c for c in candidates
+      if c.startswith(prefix) and edit_distance(term, c, max_distance) <= max_distance
+    )
+
+class NamesIndex:
+  '''
+  In-memory inverted index over names and alternative names of entities.
+
+  A document matches a query if all query terms are found in its name or
+  all query terms are found in its alternative names. The score of a
+  field is the sum of frequencies of the query terms in it and the score
+  of a document is the sum of its fields scores.
+  Ties are ordered by document ID.
+
+  A fuzzy term is scored the way Whoosh scores it: the frequency of the
+  similar term if there is one, the sum of frequencies of the similar terms
+  if there are two, and a constant 1 if there are more. Above
+  `FUZZY_CONSTANT_SCORE_MAX_DOCS` documents frequencies are always summed.
+  '''
+  def __init__(self):
+    # field -> term -> doc id -> term frequency
+    self._postings = { field: defaultdict(dict) for field in FIELDS }
+    self._docs_count = 0
+    # normalized name -> doc ids
+    self._exact_names = defaultdict(list)
+    self._fuzzy_terms = {}
+
+  def __getstate__(self):
+    # fuzzy terms indexes are cheap to rebuild, no need to persist them
+    state = self.__dict__.copy()
+    state['_fuzzy_terms'] = {}
+    return state
+
+  def add(self, doc_id: int, name: str, alternative_names: str):
+    for field, text in zip(FIELDS, [name, alternative_names]):
+      postings = self._postings[field]
+      for term in tokenize(text):
+        if term not in postings and field in self._fuzzy_terms:
+          self._fuzzy_terms[field].add(term)
+        doc_frequencies = postings[term]
+        doc_frequencies[doc_id] = doc_frequencies.get(doc_id, 0) + 1
+
+    bisect.insort(self._exact_names[normalize_name(name)], doc_id)
+    self._docs_count += 1
+
+  def remove(self, doc_id: int, name: str, alternative_names: str):
+    '''
+    `name` and `alternative_names` must be the ones the document was added with.
+    '''
+    for field, text in zip(FIELDS, [name, alternative_names]):
+      postings = self._postings[field]
+      for term in set(tokenize(text)):
+        doc_frequencies = postings.get(term)
+        if doc_frequencies is None:
+          continue
+        doc_frequencies.pop(doc_id, None)
+        if len(doc_frequencies) == 0:
+          del postings[term]
+
+    normalized_name = normalize_name(name)
+    doc_ids = self._exact_names.get(normalized_name)
+    if doc_ids is not None and doc_id in doc_ids:
+      doc_ids.remove(doc_id)
+      self._docs_count -= 1
+      if len(doc_ids) == 0:
+        del self._exact_names[normalized_name]
+
+  def _get_fuzzy_terms(self, field: str) -> FuzzyTermsIndex:
+    # built on first fuzzy query, most queries are not fuzzy.
+    if field not in self._fuzzy_terms:
+      self._fuzzy_terms[field] = FuzzyTermsIndex(self._postings[field].keys())
+    return self._fuzzy_terms[field]
+
+  def _clause_scores(self, field: str, clause: tuple) -> Dict[int, float]:
+    postings = self._postings[field]
+    if clause[0] == 'term':
+      return postings.get(clause[1], {})
+
+    _, term, max_distance, prefix_length = clause
+    # the fuzzy terms index keeps terms of removed documents
+    similar_terms = [
+      t for t in self._get_fuzzy_terms(field).similar(term, max_distance, prefix_length)
+      if t in postings
+    ]
+    constant_score = len(similar_terms) > 2 and self._docs_count <= FUZZY_CONSTANT_SCORE_MAX_DOCS
+
+    scores = {}
+    for similar_term in similar_terms:
+      for doc_id, frequency in postings[similar_term].items():
+        scores[doc_id] = 1 if constant_score else scores.get(doc_id, 0) + frequency
+    return scores
+
+  def _field_scores(self, field: str, clauses: List[tuple]) -> Dict[int, float]:
+    if len(clauses) == 0:
+      return {}
+
+    clauses_scores = sorted([self._clause_scores(field, c) for c in clauses], key=len)
+    scores = {}
+    for doc_id, score in clauses_scores[0].items():
+      for clause_scores in clauses_scores[1:]:
+        clause_score = clause_scores.get(doc_id)
+        if clause_score is None:
+          break
+        score += clause_score
+      else:
+        scores[doc_id] = score
+    return scores
+
+  def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+    clauses = parse_query(query)
+
+    scores = {}
+    for field in FIELDS:
+      for doc_id, score in self._field_scores(field, clauses).items():
+        scores[doc_id] = scores.get(doc_id, 0) + score
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return ranked[:limit]
+
+  def get_by_name(self, name: str) -> int:
+    '''
+    ID of the document with this exact (normalized) name or, if there is
+    none, of the best document having all the terms of `name` in its name.
+    '''
+    doc_ids = self._exact_names.get(normalize_name(name))
+    if doc_ids:
+      return doc_ids[0]
+
+    scores = self._field_scores('name', parse_query(name, allow_fuzzy=False))
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return ranked[0][0] if len(ranked) > 0 else None
@@ -0,0 +1,191 @@
+import os
+import csv
+import codecs
+import asyncio
+import hashlib
+import logging
+import urllib.parse
+import urllib.request
+from typing import List
+
+import aiohttp
+
+from ..util.http import HttpClient
+
+CHUNK_SIZE = 64 * 1024
+# Log loading progress every so many rows.
+PROGRESS_ROWS = 100000
+# Files can take long to download: there is no limit on the whole
+# download, only on the time spent waiting for the next bytes.
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(
+  total = None,
+  sock_connect = 30,
+  sock_read = float(os.environ.get('DOWNLOAD_READ_TIMEOUT_SEC', 60))
+)
+
+class CsvRowsParser:
+  '''
+  Parses CSV rows from chunks of UTF-8 encoded bytes as they arrive.
+  Only complete records are parsed: a line break inside a quoted
+  field does not end a record.
+  '''
+  def __init__(self):
+    self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    self._partial_line = ''
+    self._record_lines = []
+    self._record_quotes = 0
+
+  def feed(self, chunk: bytes, final: bool = False) -> List[List[str]]:
+    text = self._partial_line + self._decoder.decode(chunk, final)
+    lines = text.split('\n')
+    self._partial_line = '' if final else lines.pop()
+
+    complete_lines = []
+    for line in lines:
+      self._record_lines.append(line + '\n')
+      self._record_quotes += line.count('"')
+      # an even number of quotes means no quoted field is left open
+      if self._record_quotes % 2 == 0:
+        complete_lines += self._record_lines
+        self._record_lines = []
+        self._record_quotes = 0
+
+    if final:
+      complete_lines += self._record_lines
+      self._record_lines = []
+
+    return [r for r in csv.reader(complete_lines) if len(r) > 0]
+
+class CsvDownload:
+  '''
+  Streams rows of a CSV file from an HTTP(S) URL or, if `allow_files`
+  is set, from a `file://` URL.
+
+    async with CsvDownload(url, http_client) as download:
+      if not download.not_modified:
+        headers = await download.read_headers()
+        async for rows in download.row_chunks():
+          ...
+
+  With `etag` or `last_modified` the file is only downloaded if it has
+  changed, otherwise `not_modified` is set. Downloads exceeding `max_rows`
+  rows or `max_bytes` bytes fail.
+  '''
+  def __init__(self, url: str, http_client: HttpClient, etag: str = None, last_modified: str = None,
+               max_rows: int = None, max_bytes: int = None, allow_files: bool = False):
+    self.url = url
+    self.etag = etag
+    self.last_modified = last_modified
+    self.not_modified = False
+    self.headers = None
+    self.rows_count = 0
+    self.bytes_count = 0
+
+    self._http_client = http_client
+    self._max_rows = max_rows
+    self._max_bytes = max_bytes
+    self._allow_files = allow_files
+    self._parser = CsvRowsParser()
+    self._hash = hashlib.blake2b()
+    self._pending_rows = []
+    self._done = False
+    self._response = None
+    self._file = None
+
+  @property
+  def content_hash(self) -> str:
+    return self._hash.hexdigest()
+
+  async def __aenter__(self):
+    parsed_url = urllib.parse.urlparse(self.url)
+    if parsed_url.scheme == 'file':
+      assert self._allow_files, 'Loading entities from files is not allowed: {}'.format(self.url)
+      await self._open_file(urllib.request.url2pathname(parsed_url.path))
+    else:
+      await self._open_response()
+    return self
+
+  async def __aexit__(self, *args):
+    if self._response is not None:
+      self._response.release()
+    if self._file is not None:
+      self._file.close()
+
+  async def _open_file(self, path):
+    last_modified = str(os.path.getmtime(path))
+    if last_modified == self.last_modified:
+      self.not_modified = True
+      return
+    self.last_modified = last_modified
+    self._file = open(path, 'rb')
+
+  async def _open_response(self):
+    headers = {}
+    if self.etag is not None:
+      headers['If-None-Match'] = self.etag
+    if self.last_modified is not None:
+      headers['If-Modified-Since'] = self.last_modified
+
+    self._response = await self._http_client.session.get(self.url, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+    if self._response.status == 304:
+      self.not_modified = True
+      return
+    if self._response.status != 200:
+      raise Exception('An error returned while trying to download file from {}: {}'.format(self.url, self._response.status))
+
+    self.etag = self._response.headers.get('ETag')
+    self.last_modified = self._response.headers.get('Last-Modified')
+
+  async def _read_chunk(self) -> bytes:
+    if self._file is not None:
+      loop = asyncio.get_event_loop()
+      return await loop.run_in_executor(None, self._file.read, CHUNK_SIZE)
+    return await self._response.content.read(CHUNK_SIZE)
+
+  async def _next_rows(self) -> List[List[str]]:
+    '''
+    Rows parsed from the next chunk (possibly none) or `None` at the end of the file.
+    '''
+    if self._done:
+      return None
+
+    chunk = await self._read_chunk()
+    self._done = len(chunk) == 0
+    self._hash.update(chunk)
+    self.bytes_count += len(chunk)
+    assert self._max_bytes is None or self.bytes_count <= self._max_bytes, \
+      'File {} is larger than {} bytes'.format(self.url, self._max_bytes)
+
+    rows = self._parser.feed(chunk, final=self._done)
+
+    previous_rows_count = self.rows_count
+    self.rows_count += len(rows)
+    assert self._max_rows is None or self.rows_count <= self._max_rows + 1, \
+      'File {} has more than {} rows'.format(self.url, self._max_rows)
+
+    if self.rows_count // PROGRESS_ROWS > previous_rows_count // PROGRESS_ROWS:
+      logging.info('Loading {}: {} rows, {} bytes'.format(self.url, self.rows_count, self.bytes_count))
+
+    return rows
+
+  async def read_headers(self) -> List[str]:
+    while self.headers is None:
+      rows = await self._next_rows()
+      assert rows is not None, 'File {} is empty'.format(self.url)
+      if len(rows) > 0:
+        self.headers = rows[0]
+        self._pending_rows = rows[1:]
+    return self.headers
+
+  async def row_chunks(self):
+    await self.read_headers()
+    if len(self._pending_rows) > 0:
+      rows, self._pending_rows = self._pending_rows, []
+      yield rows
+
+    while True:
+      rows = await self._next_rows()
+      if rows is None:
+        return
+      if len(rows) > 0:
+        yield rows
@@ -1,13 +1,15 @@
-from whoosh import scoring
-from whoosh.filedb.filestore import RamStorage
-from whoosh.fields import Schema, TEXT, ID
-from whoosh.qparser import QueryParser, FuzzyTermPlugin
-
+import asyncio
+import hashlib
+from .index import NamesIndex
+from .columns import ColumnsStore
+from .gazetteer import Gazetteer
+from ..util.singleflight import SingleFlight
 from ..ned.result import NedResource, NedResultEntity, NedResult, ENTITY_TYPES
 
 NAME_HEADER = 'name'
 ALT_NAMES_HEADER = 'alternative_names'
 TYPE_HEADER = 'type'
+ID_HEADER = 'id'
 
 NED_RESOURCE_FIELDS = [
   'description',
@@ -24,70 +26,268 @@ FIELD_MAPPERS = {
   'alternative_names': lambda v: ('alternative_names', [i.strip() for i in v.split(';') if i.strip() != '']),
 }
 
+def get_key_hash(value: str, occurrence: int) -> int:
+  '''
+  64 bits hash of a row key.
+  '''
+  digest = hashlib.blake2b('{}\0{}'.format(value, occurrence).encode('utf-8'), digest_size=8).digest()
+  return int.from_bytes(digest, 'little')
+
 class EntitiesSet:
-  def __init__(self, url, headers, rows):
+  def __init__(self, url, headers, rows = None, content_hash = None):
     self.url = url
     self.headers = headers
-    self.rows = rows
-
-    self.schema = Schema(
-      name=TEXT(stored=False),
-      alternative_names=TEXT(stored=False),
-      id=ID(stored=True)
-    )
-    self.index = RamStorage().create_index(self.schema)
+    self.rows = ColumnsStore(len(headers))
+    # hash of the CSV file the set was built from
+    self.content_hash = content_hash
+    # validators of the CSV file response, used to check whether it has changed
+    self.etag = None
+    self.last_modified = None
 
     for c in [NAME_HEADER, ALT_NAMES_HEADER, TYPE_HEADER]:
       assert c in self.headers, 'Required "{}" column not found in {}'.format(c, url)
 
-    name_idx = self.headers.index(NAME_HEADER)
-    alt_names_idx = self.headers.index(ALT_NAMES_HEADER)
+    self._name_idx = self.headers.index(NAME_HEADER)
+    self._alt_names_idx = self.headers.index(ALT_NAMES_HEADER)
+    self._type_idx = self.headers.index(TYPE_HEADER)
+    self._key_idx = self.headers.index(ID_HEADER) if ID_HEADER in self.headers else self._name_idx
+    self._output_columns = self._get_output_columns()
+
+    self.index = NamesIndex()
+    # built on first scan, rebuilt when rows change
+    self._gazetteer = None
+    self._gazetteer_in_flight = SingleFlight()
+    self._lock = None
+    self._version = 0
+    # hash of the key of every row -> row position. Keys are checked against
+    # the rows, keys whose hash is taken by another key are in `_colliding_ids`.
+    self._ids_by_key = {}
+    self._colliding_ids = {}
+    if rows is not None:
+      self.append_rows(rows)
+
+  def __getstate__(self):
+    # mappers are functions, worked out again when loaded
+    state = self.__dict__.copy()
+    del state['_output_columns']
+    del state['_gazetteer_in_flight']
+    del state['_lock']
+    state['_gazetteer'] = None
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._output_columns = self._get_output_columns()
+    self._gazetteer_in_flight = SingleFlight()
+    self._lock = None
+
+  @property
+  def lock(self) -> asyncio.Lock:
+    '''
+    Held while the set is updated. Hold it to read the set outside
+    of the event loop, e.g. to save it from a thread.
+    '''
+    # created on first use: sets are built and loaded in threads without an event loop
+    if self._lock is None:
+      self._lock = asyncio.Lock()
+    return self._lock
+
+  def _get_output_columns(self):
+    '''
+    How columns end up in a `NedResource`, worked out once for all rows:
+    a list of `(column position, mapper, is a resource field)`.
+    `mapper` turns a value into a `(field, value)` tuple.
+    '''
+    output_columns = []
+    for position, header in enumerate(self.headers):
+      if header in [NAME_HEADER, TYPE_HEADER]:
+        continue
+      mapper = FIELD_MAPPERS.get(header, lambda v, header=header: (header, v))
+      field, _ = mapper('')
+      output_columns.append((position, mapper, field in NED_RESOURCE_FIELDS))
+    return output_columns
+
+  def _row_key(self, row, occurrences = None):
+    '''
+    Key identifying a row across versions of the CSV file: the value of
+    the "id" column if there is one or the name otherwise. Repeated values
+    are told apart by the number of times they have been seen before,
+    counted in `occurrences` or, without it, among the rows of the set.
+    '''
+    value = row[self._key_idx]
+    if occurrences is not None:
+      occurrence = occurrences.get(value, 0)
+      occurrences[value] = occurrence + 1
+    else:
+      occurrence = 0
+      while self._find_row(value, occurrence) is not None:
+        occurrence += 1
+    return (value, occurrence)
+
+  def _find_row(self, value, occurrence):
+    idx = self._ids_by_key.get(get_key_hash(value, occurrence))
+    if idx is not None and self.rows.value(idx, self._key_idx) == value:
+      return idx
+    return self._colliding_ids.get((value, occurrence))
+
+  def _add_key(self, key, idx):
+    key_hash = get_key_hash(*key)
+    if key_hash in self._ids_by_key:
+      self._colliding_ids[key] = idx
+    else:
+      self._ids_by_key[key_hash] = idx
+
+  def _index_row(self, idx, row):
+    self.index.add(idx, str(row[self._name_idx]), str(row[self._alt_names_idx]))
 
-    writer = self.index.writer()
-    for idx, row in enumerate(self.rows):
-      name = row[name_idx]
-      alt_names = row[alt_names_idx]
-      writer.add_document(
-        name=str(name),
-        alternative_names=str(alt_names),
-        id=str(idx)
-      )
-    writer.commit()
+  def _unindex_row(self, idx, row):
+    self.index.remove(idx, str(row[self._name_idx]), str(row[self._alt_names_idx]))
 
-    parser = QueryParser("name", self.index.schema)
-    self.exact_name_query_parser = parser
+  def append_rows(self, rows):
+    self._version += 1
+    for row in rows:
+      idx = len(self.rows)
+      key = self._row_key(row)
+      self.rows.append(row)
+      self._add_key(key, idx)
+      self._index_row(idx, row)
 
-    parser = QueryParser("name", self.index.schema)
-    parser.add_plugin(FuzzyTermPlugin())
-    self.name_query_parser = parser
+  async def update(self, rows_chunks):
+    '''
+    Apply a new version of the rows, coming as an async iterable of lists
+    of rows: new rows are added, changed rows are replaced keeping their
+    IDs and rows that are gone are removed.
+    Changes are staged while rows are read and applied at once after the
+    last one: the set is left as it was if reading the rows fails.
+    Rows must have the same headers as the current ones.
+    '''
+    occurrences = {}
+    # positions of the rows found in the new version
+    seen = bytearray(len(self.rows))
+    # new and changed rows with their position (-1 for new rows) and key
+    staged_rows = ColumnsStore(self.rows.n_columns)
+    staged = []
 
-    parser = QueryParser("alternative_names", self.index.schema)
-    parser.add_plugin(FuzzyTermPlugin())
-    self.alt_names_query_parser = parser
+    async for rows in rows_chunks:
+      for row in rows:
+        key = self._row_key(row, occurrences)
+        idx = self._find_row(*key)
+        if idx is not None:
+          seen[idx] = 1
+        if idx is None or self.rows[idx] != self.rows.padded(row):
+          staged_rows.append(row)
+          staged.append((-1 if idx is None else idx, key))
+
+    async with self.lock:
+      return self._apply_update(staged_rows, staged, seen)
+
+  def _apply_update(self, staged_rows, staged, seen):
+    stats = { 'added': 0, 'updated': 0, 'removed': 0 }
+
+    removed = set()
+    idx = seen.find(0)
+    while idx >= 0:
+      if not self.rows.is_deleted(idx):
+        self._unindex_row(idx, self.rows[idx])
+        # keep the position, IDs of the following rows must not change
+        self.rows[idx] = None
+        removed.add(idx)
+      idx = seen.find(0, idx + 1)
+
+    if len(removed) > 0:
+      self._ids_by_key = { h: idx for h, idx in self._ids_by_key.items() if idx not in removed }
+      self._colliding_ids = { k: idx for k, idx in self._colliding_ids.items() if idx not in removed }
+      stats['removed'] = len(removed)
+
+    for position, (idx, key) in enumerate(staged):
+      row = staged_rows[position]
+      if idx < 0:
+        idx = len(self.rows)
+        self.rows.append(row)
+        self._add_key(key, idx)
+        self._index_row(idx, row)
+        stats['added'] += 1
+      else:
+        self._unindex_row(idx, self.rows[idx])
+        self.rows[idx] = row
+        self._index_row(idx, row)
+        stats['updated'] += 1
+
+    if self.rows.needs_compaction:
+      self.rows.compact()
+
+    self._version += 1
+    return stats
 
   async def search(self, query_str, n_items):
-    with self.index.searcher(weighting=scoring.Frequency) as searcher:
-      name_query = self.name_query_parser.parse(query_str)
-      alt_names_query = self.alt_names_query_parser.parse(query_str)
+    results = self.index.search(query_str, limit=n_items)
+    resources = [self.to_ned_result_item(idx, float(score)) for idx, score in results]
+
+    entity = NedResultEntity(
+      entity = query_str,
+      score = 1.0,
+      left = 0,
+      right = len(query_str),
+      resources = resources,
+      matched_resource = resources[0] if len(resources) > 0 else None
+    )
 
-      query = name_query | alt_names_query
-      
-      results = searcher.search(query, limit=n_items)
-      resources = [self.to_ned_result_item(i) for i in results]
+    return NedResult(
+      text = query_str,
+      entities = [entity]
+    )
+
+  def build_gazetteer(self) -> Gazetteer:
+    gazetteer = Gazetteer()
+    alt_names_mapper = FIELD_MAPPERS[ALT_NAMES_HEADER]
+    for idx in range(len(self.rows)):
+      if self.rows.is_deleted(idx):
+        continue
+      gazetteer.add(self.rows.value(idx, self._name_idx), idx)
+      _, alt_names = alt_names_mapper(self.rows.value(idx, self._alt_names_idx))
+      for alt_name in alt_names:
+        gazetteer.add(alt_name, idx, priority = 1)
+    gazetteer.build()
+    return gazetteer
 
-      entity = NedResultEntity(
-        entity = query_str,
+  async def _get_gazetteer(self) -> Gazetteer:
+    version = self._version
+    if self._gazetteer is not None and self._gazetteer[0] == version:
+      return self._gazetteer[1]
+
+    loop = asyncio.get_event_loop()
+    gazetteer = await self._gazetteer_in_flight.run(
+      version,
+      lambda: loop.run_in_executor(None, self.build_gazetteer)
+    )
+    # rows may have changed while it was being built
+    if version == self._version:
+      self._gazetteer = (version, gazetteer)
+    return gazetteer
+
+  async def scan(self, text, n_items):
+    '''
+    Find all entities of the set whose name or alternative name is
+    mentioned in `text`. Entities matching by name come first.
+    '''
+    gazetteer = await self._get_gazetteer()
+
+    entities = []
+    for left, right, doc_ids in gazetteer.scan(text):
+      resources = [self.to_ned_result_item(idx) for idx in doc_ids[:n_items]]
+      entities.append(NedResultEntity(
+        entity = text[left:right],
         score = 1.0,
-        left = 0,
-        right = len(query_str),
+        left = left,
+        right = right,
         resources = resources,
-        matched_resource = resources[0] if len(resources) > 0 else None
-      )
+        matched_resource = resources[0]
+      ))
 
-      return NedResult(
-        text = query_str,
-        entities = [entity]
-      )
+    return NedResult(
+      text = text,
+      entities = entities
+    )
 
   def get_by_id(self, id):
     try:
@@ -95,53 +295,43 @@ class EntitiesSet:
     except:
       return None
 
-    resource_id = id if numeric_id < len(self.rows) else None
+    resource_id = id if 0 <= numeric_id < len(self.rows) and not self.rows.is_deleted(numeric_id) else None
     if resource_id is None:
       return None
 
-    return self.to_ned_result_item({ 'id': id })
+    return self.to_ned_result_item(numeric_id)
 
   def get_by_label(self, label):
-    with self.index.searcher(weighting=scoring.Frequency) as searcher:
-      query = self.exact_name_query_parser.parse(label)
-
-      results = searcher.search(query, limit=1)
-      resources = [self.to_ned_result_item(i) for i in results]
-
-      return resources[0] if len(resources) > 0 else None
+    if label is None:
+      return None
 
-  def to_ned_result_item(self, result):
-    id = int(result['id'])
-    row = self.rows[id]
+    idx = self.index.get_by_name(label)
+    return self.to_ned_result_item(idx) if idx is not None else None
 
-    type_idx = self.headers.index(TYPE_HEADER)
-    name_idx = self.headers.index(NAME_HEADER)
+  def to_ned_result_item(self, idx, score = 1):
+    row = self.rows[idx]
+    tag = row[self._type_idx]
 
     resource_kwargs = {
-      'score': getattr(result, 'score', 1),
+      'score': score,
       'model': 'external:{}'.format(self.url),
-      'id': result['id'],
-      'tag': row[type_idx] if row[type_idx] in ENTITY_TYPES else 'UNK',
-      'label': row[name_idx]
+      'id': str(idx),
+      'tag': tag if tag in ENTITY_TYPES else 'UNK',
+      'label': row[self._name_idx]
     }
 
     metadata = {}
 
-    for header in self.headers:
-      value = row[self.headers.index(header)].strip()
-      if header in [NAME_HEADER, TYPE_HEADER]:
-        continue
-      if header in FIELD_MAPPERS:
-        mapper = FIELD_MAPPERS[header]
-        header, value = mapper(value)
+    for position, mapper, is_resource_field in self._output_columns:
+      field, value = mapper(row[position].strip())
 
       if len(value) == 0:
         continue
-      
-      if header in NED_RESOURCE_FIELDS:
-        resource_kwargs[header] = value
+
+      if is_resource_field:
+        resource_kwargs[field] = value
       else:
-        metadata[header] = value
+        metadata[field] = value
 
     resource_kwargs['metadata'] = metadata
 
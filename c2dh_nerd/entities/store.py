@@ -1,28 +1,215 @@
-import aiohttp
-import csv
+import os
+import pickle
+import time
+import asyncio
+import hashlib
+import logging
 from .set import EntitiesSet
+from .loader import CsvDownload
+from ..util.http import HttpClient
+from ..util.singleflight import SingleFlight
 
-async def get_content(url):
-  async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False)) as session:
-    async with session.get(url) as resp:
-      if resp.status != 200:
-        raise Exception('An error returned while trying to download file from {}: {}'.format(url, resp.status))
-      return await resp.text()
+# Bump when the pickled layout of `EntitiesSet` changes.
+INDEX_FORMAT_VERSION = 8
+# How often, at most, a set in memory is checked against its saved index.
+INDEX_CHECK_INTERVAL_SEC = 1
+
+def get_index_path(index_dir: str, url: str) -> str:
+  url_hash = hashlib.blake2b(bytes(url, 'utf-8')).hexdigest()
+  return os.path.join(index_dir, '{}.pickle'.format(url_hash))
+
+def get_index_mtime(path: str) -> int:
+  try:
+    return os.stat(path).st_mtime_ns
+  except FileNotFoundError:
+    return None
+
+def load_index(path: str, url: str) -> EntitiesSet:
+  try:
+    with open(path, 'rb') as f:
+      data = pickle.load(f)
+  except FileNotFoundError:
+    return None
+  except Exception as err:
+    logging.warning('Could not load entities set index from "{}": {}'.format(path, err))
+    return None
+
+  if data.get('version') != INDEX_FORMAT_VERSION or data.get('url') != url:
+    return None
+  return data['entities_set']
+
+def save_index(path: str, entities_set: EntitiesSet) -> int:
+  '''
+  Returns the modification time of the saved index.
+  '''
+  data = {
+    'version': INDEX_FORMAT_VERSION,
+    'url': entities_set.url,
+    'entities_set': entities_set
+  }
+  # write to a temporary file first so that other workers never see a partial index
+  tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+  with open(tmp_path, 'wb') as f:
+    pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+  os.replace(tmp_path, path)
+  return get_index_mtime(path)
 
 
 class EntitiesSetsStore:
-  def __init__(self):
+  '''
+  Entities sets by URL of their CSV file.
+
+  CSV files are streamed and indexed as they are downloaded. Files with
+  more than `max_rows` rows or `max_bytes` bytes are rejected. `file://`
+  URLs are only accepted if `allow_files` is set.
+
+  If `index_dir` is provided, built sets are saved there and loaded from
+  there the first time a set is requested after a restart, instead of
+  downloading and indexing the CSV file again.
+
+  Processes sharing `index_dir` (e.g. server workers) see the sets
+  saved by each other: a set is loaded again when its index has been
+  saved by another process since, so that a set loaded or refreshed
+  by one worker is used by all of them.
+
+  If `refresh_interval_sec` is provided, a set older than that is
+  refreshed in the background when it is requested.
+  '''
+  def __init__(self, http_client: HttpClient = None, index_dir: str = None, refresh_interval_sec: float = None,
+               max_rows: int = None, max_bytes: int = None, allow_files: bool = False):
     self.store = {}
+    self._http_client = http_client if http_client is not None else HttpClient()
+    self._index_dir = index_dir
+    self._refresh_interval_sec = refresh_interval_sec
+    self._max_rows = max_rows
+    self._max_bytes = max_bytes
+    self._allow_files = allow_files
+    self._checked_at = {}
+    # modification time of the index of every set in memory
+    self._index_mtimes = {}
+    self._index_checked_at = {}
+    self._in_flight = SingleFlight()
+
+    if self._index_dir is not None:
+      os.makedirs(self._index_dir, exist_ok=True)
 
   async def get(self, url):
     if url not in self.store:
-      text = await get_content(url)
+      self.store[url] = await self._in_flight.run(url, lambda: self._load(url))
+      self._checked_at.setdefault(url, time.time())
+      return self.store[url]
+
+    await self._reload_if_saved_elsewhere(url)
+    if self._refresh_interval_sec is not None and time.time() - self._checked_at.get(url, 0) > self._refresh_interval_sec:
+      self._checked_at[url] = time.time()
+      asyncio.ensure_future(self._refresh_in_background(url))
+    return self.store[url]
 
-      csv_reader = csv.reader(text.split('\n'))
-      rows = [r for r in csv_reader]
-      headers = rows[0]
-      rows = rows[1:]
+  async def refresh(self, url) -> dict:
+    '''
+    Check whether the CSV file has changed and apply the changes to the set.
+    '''
+    await self.get(url)
+    self._checked_at[url] = time.time()
+    return await self._in_flight.run('refresh:{}'.format(url), lambda: self._refresh(url))
 
-      entities_set = EntitiesSet(url, headers, rows)
+  async def _reload_if_saved_elsewhere(self, url):
+    index_path = self._get_index_path(url)
+    now = time.time()
+    if index_path is None or now - self._index_checked_at.get(url, 0) < INDEX_CHECK_INTERVAL_SEC:
+      return
+    self._index_checked_at[url] = now
+
+    mtime = get_index_mtime(index_path)
+    if mtime is not None and mtime != self._index_mtimes.get(url):
+      await self._in_flight.run('reload:{}'.format(url), lambda: self._reload(url, index_path))
+
+  async def _reload(self, url, index_path):
+    mtime = get_index_mtime(index_path)
+    loop = asyncio.get_event_loop()
+    entities_set = await loop.run_in_executor(None, load_index, index_path, url)
+    # not reloaded again if it cannot be loaded, until it is saved again
+    self._index_mtimes[url] = mtime
+    if entities_set is not None:
+      logging.info('Entities set "{}" was saved by another process, using it'.format(url))
       self.store[url] = entities_set
-    return self.store[url]
+
+  async def _refresh_in_background(self, url):
+    try:
+      await self.refresh(url)
+    except Exception as err:
+      logging.warning('Could not refresh entities set "{}": {}'.format(url, err))
+
+  def _download(self, url, etag = None, last_modified = None) -> CsvDownload:
+    return CsvDownload(
+      url, self._http_client, etag, last_modified,
+      max_rows = self._max_rows,
+      max_bytes = self._max_bytes,
+      allow_files = self._allow_files
+    )
+
+  async def _load(self, url) -> EntitiesSet:
+    index_path = self._get_index_path(url)
+
+    if index_path is not None:
+      mtime = get_index_mtime(index_path)
+      loop = asyncio.get_event_loop()
+      entities_set = await loop.run_in_executor(None, load_index, index_path, url)
+      if entities_set is not None:
+        self._index_mtimes[url] = mtime
+        return entities_set
+
+    async with self._download(url) as download:
+      entities_set = await self._build(download)
+
+    await self._save(entities_set)
+    return entities_set
+
+  async def _build(self, download: CsvDownload) -> EntitiesSet:
+    loop = asyncio.get_event_loop()
+    headers = await download.read_headers()
+    entities_set = EntitiesSet(download.url, headers)
+
+    # nobody else sees the set before it is built, safe to index in a thread
+    async for rows in download.row_chunks():
+      await loop.run_in_executor(None, entities_set.append_rows, rows)
+
+    entities_set.content_hash = download.content_hash
+    entities_set.etag = download.etag
+    entities_set.last_modified = download.last_modified
+    return entities_set
+
+  async def _refresh(self, url) -> dict:
+    entities_set = self.store[url]
+    stats = { 'changed': False, 'added': 0, 'updated': 0, 'removed': 0 }
+
+    async with self._download(url, entities_set.etag, entities_set.last_modified) as download:
+      if download.not_modified:
+        return stats
+
+      headers = await download.read_headers()
+      if headers == entities_set.headers:
+        stats.update(await entities_set.update(download.row_chunks()))
+        entities_set.content_hash = download.content_hash
+        entities_set.etag = download.etag
+        entities_set.last_modified = download.last_modified
+      else:
+        # columns changed: nothing to keep from the current set
+        entities_set = await self._build(download)
+        stats['added'] = len(entities_set.rows)
+        self.store[url] = entities_set
+
+    stats['changed'] = stats['added'] + stats['updated'] + stats['removed'] > 0
+    await self._save(entities_set)
+    return stats
+
+  def _get_index_path(self, url):
+    return get_index_path(self._index_dir, url) if self._index_dir is not None else None
+
+  async def _save(self, entities_set: EntitiesSet):
+    index_path = self._get_index_path(entities_set.url)
+    if index_path is not None:
+      loop = asyncio.get_event_loop()
+      # the set is pickled in a thread, it must not change meanwhile
+      async with entities_set.lock:
+        self._index_mtimes[entities_set.url] = await loop.run_in_executor(None, save_index, index_path, entities_set)
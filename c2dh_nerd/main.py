@@ -1,35 +1,75 @@
 import os
+import asyncio
 import traceback
 from aiohttp import web
 from . import routes
-from .context import add_context, get_data
+from .context import add_context, start_preload, close_context, prepare_fork, get_data
+from .util.executor import InferenceQueueFull
+from .util.prefork import create_socket, run_workers
+from .util.routes import MAX_REQUEST_SIZE_MB
 
 @web.middleware
 async def error_handler_middleware(request, handler):
     try:
         return await handler(request)
+    except web.HTTPException:
+        # e.g. 404 or 413: already an HTTP response
+        raise
     except AssertionError as err:
         return web.json_response({
             'message': str(err)
         }, status=400)
+    except InferenceQueueFull as err:
+        return web.json_response({
+            'message': str(err)
+        }, status=503)
     except Exception as err:
         return web.json_response({
             'message': '{}: {}'.format(err.__class__.__name__, str(err)),
             'stack': traceback.format_exc()
         }, status=500)
 
-PORT = os.environ.get('PORT', 8002)
+PORT = int(os.environ.get('PORT', 8002))
+# Number of server processes sharing the port.
+WORKERS = int(os.environ.get('WORKERS', 1))
 
-def main():
-    get_data()
-    app = web.Application(middlewares=[error_handler_middleware])
+def create_app():
+    app = web.Application(
+        middlewares=[error_handler_middleware],
+        client_max_size=MAX_REQUEST_SIZE_MB * 1024 * 1024
+    )
     app = add_context(app)
+    app.on_startup.append(start_preload)
+    app.on_cleanup.append(close_context)
     app.add_routes([
         web.get('/status', routes.status.handler),
+        web.get('/ready', routes.status.ready_handler),
         web.post('/ner', routes.ner.handler),
         web.post('/ned', routes.ned.handler),
+        web.post('/ner/batch', routes.ner.batch_handler),
+        web.post('/ned/batch', routes.ned.batch_handler),
+        web.post('/ner/stream', routes.ner.stream_handler),
+        web.post('/ned/stream', routes.ned.stream_handler),
         web.post('/entities/expand', routes.entities.expand_handler),
         web.post('/entities/load', routes.entities.load_handler),
+        web.post('/entities/refresh', routes.entities.refresh_handler),
         web.post('/entities/search', routes.entities.search_handler)
     ])
-    web.run_app(app, port = PORT)
+    return app
+
+def run_worker(app, sock):
+    # the event loop of the parent process, if any, must not be shared
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    web.run_app(app, sock = sock)
+
+def main():
+    get_data()
+    app = create_app()
+
+    if WORKERS <= 1:
+        web.run_app(app, port = PORT)
+        return
+
+    sock = create_socket(PORT)
+    prepare_fork(app)
+    run_workers(WORKERS, lambda: run_worker(app, sock))
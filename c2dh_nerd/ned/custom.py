@@ -26,3 +26,15 @@ class CustomEntitiesSourceNed(NED):
       resource = custom_entities_set.get_by_label(label)
 
     return resource
+
+class CustomEntitiesGazetteerNed(CustomEntitiesSourceNed):
+  '''
+  Finds every entity of the custom entities set mentioned in the text
+  instead of searching the set with the text.
+  '''
+  async def extract(self, text: TextOrSentences, **kwargs) -> NedResult:
+    full_text = sentences_to_text(text)
+    url = kwargs.get('url')
+
+    custom_entities_set = await self.custom_entities_store.get(url)
+    return await custom_entities_set.scan(full_text, 10)
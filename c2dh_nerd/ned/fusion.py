@@ -1,12 +1,12 @@
 import re
 import asyncio
+import logging
 from .ned import NED, TextOrSentences, sentences_to_text
 from .result import NedResult, NedResultEntity
+from ..util.batching import MicroBatcher
 
 ANY_TEXT_RE = re.compile(r'.*\w.*', re.M)
 
-flatten = lambda l: [item for sublist in l for item in sublist]
-
 def has_text(ner_entity):
   return ANY_TEXT_RE.match(ner_entity.entity) is not None
 
@@ -29,16 +29,159 @@ def merge_as_ned_result_entity(ner_entity, ned_entity):
     tag = ner_entity.tag
   )
 
+def overlaps(entity, spans):
+  return any(entity.left < right and left < entity.right for left, right in spans)
+
+def surface_form_key(ner_entity, with_tag = False):
+  '''
+  Occurrences of an entity with the same key are disambiguated once.
+  '''
+  surface_form = ' '.join(ner_entity.entity.split()).casefold()
+  return (surface_form, ner_entity.tag) if with_tag else surface_form
+
+def is_matched(ned_result):
+  return ned_result is not None and len(ned_result.entities) > 0 and ned_result.entities[0].matched_resource is not None
+
+def per_ned(value, neds):
+  '''
+  A value for every NED: `value` can be one value for all of them or a list.
+  '''
+  return list(value) if isinstance(value, (list, tuple)) else [value] * len(neds)
+
 class FusionNed(NED):
-  def __init__(self, ners, neds):
+  '''
+  Entities found by NER go through NEDs one after another until one of
+  them matches the entity. Every entity goes through the NEDs on its own,
+  without waiting for the other entities.
+
+  Entities with the same surface form (ignoring case and whitespace and,
+  if `group_by_tag` is set, with the same tag) are disambiguated once
+  and the result is applied to all of them.
+
+  If `gazetteer` is provided, entities it finds in the text are taken
+  as they are and NER entities overlapping them are not disambiguated.
+
+  NEDs with an `extract_many` method get the entities of a document
+  that reach them together, batched by their `max_batch_size` and
+  `max_batch_wait_ms`. Entities of other documents are never added.
+
+  Options, either one value for all NEDs or a list with a value per NED:
+   * `deadline_sec` - time from the start of the request after which
+     results of the NED are not waited for anymore. Entities it has not
+     disambiguated in time are passed on to the next NED or, for the
+     last NED, returned without resources.
+   * `max_concurrency` - number of concurrent requests to the NED.
+   * `speculative_delay_sec` - if a NED takes longer than that for an
+     entity, the next NED is started too without waiting for it.
+  '''
+  def __init__(self, ners, neds, gazetteer = None, deadline_sec = None, max_concurrency = None, speculative_delay_sec = None,
+               group_by_tag = False):
     assert len(ners) == 1, 'Only 1 NER is supported at the moment'
     assert len(neds) > 0, 'At least 1 NED is required'
     self._ner = ners[0]
     self._neds = neds
+    self._gazetteer = gazetteer
+    self._deadlines_sec = per_ned(deadline_sec, neds)
+    self._max_concurrency = per_ned(max_concurrency, neds)
+    # created on first use, from within the running event loop
+    self._semaphores = None
+    self._speculative_delays_sec = per_ned(speculative_delay_sec, neds)
+    self._group_by_tag = group_by_tag
+
+  async def warm_up(self):
+    # NEDs call remote services or look up indexes, only the NER needs it
+    await self._ner.warm_up()
+
+  def _get_batchers(self):
+    '''
+    Batchers of one document for NEDs that support it, `None` for the others.
+    '''
+    return [
+      MicroBatcher(ned.extract_many, ned.max_batch_size, ned.max_batch_wait_ms) if hasattr(ned, 'extract_many') else None
+      for ned in self._neds
+    ]
+
+  async def _extract_with_ned(self, ned_idx, text, deadlines, batchers, kwargs) -> NedResult:
+    '''
+    Result of a NED or `None` if it is not ready before its deadline.
+    '''
+    ned = self._neds[ned_idx]
+    batcher = batchers[ned_idx]
+    if self._semaphores is None:
+      self._semaphores = [asyncio.Semaphore(n) if n is not None else None for n in self._max_concurrency]
+    semaphore = self._semaphores[ned_idx]
+
+    async def extract_one():
+      if batcher is None:
+        return await ned.extract(text, **kwargs)
+      results = await batcher.submit([text])
+      return results[0]
+
+    async def extract():
+      if semaphore is None:
+        return await extract_one()
+      async with semaphore:
+        return await extract_one()
+
+    if deadlines[ned_idx] is None:
+      return await extract()
+
+    timeout = deadlines[ned_idx] - asyncio.get_event_loop().time()
+    try:
+      return await asyncio.wait_for(extract(), max(timeout, 0))
+    except asyncio.TimeoutError:
+      logging.warning('NED {} did not disambiguate "{}" in time'.format(type(ned).__name__, text))
+      return None
+
+  async def _disambiguate(self, entity, deadlines, batchers, kwargs) -> NedResult:
+    '''
+    Result of the first NED matching the entity or of the last NED.
+    '''
+    tasks = {}
+
+    def start(ned_idx):
+      if ned_idx < len(self._neds) and ned_idx not in tasks:
+        tasks[ned_idx] = asyncio.ensure_future(self._extract_with_ned(ned_idx, entity.entity, deadlines, batchers, kwargs))
+
+    try:
+      result = None
+      for ned_idx in range(len(self._neds)):
+        start(ned_idx)
+        task = tasks[ned_idx]
+
+        delay = self._speculative_delays_sec[ned_idx]
+        if delay is not None and ned_idx < len(self._neds) - 1:
+          done, _ = await asyncio.wait([task], timeout=delay)
+          if len(done) == 0:
+            start(ned_idx + 1)
+
+        result = await task
+        if is_matched(result):
+          return result
+      return result
+    finally:
+      # speculative calls whose results are not needed
+      for task in tasks.values():
+        if not task.done():
+          task.cancel()
 
   async def extract(self, text: TextOrSentences, **kwargs) -> NedResult:
-    ner_result = await self._ner.extract(text)
-    entities = [e for e in ner_result.entities if has_text(e)]
+    loop = asyncio.get_event_loop()
+    start_time = loop.time()
+    deadlines = [start_time + d if d is not None else None for d in self._deadlines_sec]
+
+    if self._gazetteer is not None:
+      ner_result, gazetteer_result = await asyncio.gather(
+        self._ner.extract(text),
+        self._gazetteer.extract(text, **kwargs)
+      )
+      gazetteer_entities = gazetteer_result.entities
+    else:
+      ner_result = await self._ner.extract(text)
+      gazetteer_entities = []
+
+    gazetteer_spans = [(e.left, e.right) for e in gazetteer_entities]
+    entities = [e for e in ner_result.entities if has_text(e) and not overlaps(e, gazetteer_spans)]
 
     if len(entities) == 1:
       e = entities[0]
@@ -47,43 +190,26 @@ class FusionNed(NED):
       if entity_length_ratio > 0.5:
         print('A single very long entity detected ("{}") in {}'.format(e.entity, full_text))
 
-    remaining_entities = entities[:]
-
-    all_entity_and_ned_result_lists = []
-
-    for ned_idx, ned in enumerate(self._neds):
-      if len(remaining_entities) > 0:
-        ned_results = await asyncio.gather(*[
-          ned.extract(e.entity, **kwargs)
-          for e in remaining_entities
-        ])
-
-        entity_and_ned_result_list = list(zip(remaining_entities, ned_results))
-
-        remaining_entities = [
-          entity
-          for entity, result in entity_and_ned_result_list
-          if len(result.entities) == 0 or result.entities[0].matched_resource is None
-        ]
-
-        if ned_idx < len(self._neds) - 1:
-          entity_and_ned_result_list = [
-            (entity, result)
-            for entity, result in entity_and_ned_result_list
-            if len(result.entities) > 0 and result.entities[0].matched_resource is not None
-          ]
-
-        all_entity_and_ned_result_lists.append(entity_and_ned_result_list)
+    # first occurrence of every surface form
+    unique_entities = {}
+    for e in entities:
+      unique_entities.setdefault(surface_form_key(e, self._group_by_tag), e)
 
+    batchers = self._get_batchers()
+    unique_ned_results = await asyncio.gather(*[
+      self._disambiguate(e, deadlines, batchers, kwargs)
+      for e in unique_entities.values()
+    ])
+    ned_results_by_key = dict(zip(unique_entities.keys(), unique_ned_results))
+    ned_results = [ned_results_by_key[surface_form_key(e, self._group_by_tag)] for e in entities]
 
-    entity_and_ned_result_list = flatten(all_entity_and_ned_result_lists)
     # we do not accept results when a single entity from NER
     # was found to be multiple entities by NED. Such results
     # are filtered out.
     ned_result_entities = [
-      merge_as_ned_result_entity(entity, ned_result.entities[0] if len(ned_result.entities) > 0 else None)
-      for entity, ned_result in entity_and_ned_result_list
-      if len(ned_result.entities) < 2 
+      merge_as_ned_result_entity(entity, ned_result.entities[0] if ned_result is not None and len(ned_result.entities) > 0 else None)
+      for entity, ned_result in zip(entities, ned_results)
+      if ned_result is None or len(ned_result.entities) < 2
     ]
 
-    return NedResult(sentences_to_text(text), ned_result_entities)
+    return NedResult(sentences_to_text(text), gazetteer_entities + ned_result_entities)
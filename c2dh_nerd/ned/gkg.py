@@ -1,10 +1,16 @@
 import os
 import json
+import asyncio
 import hashlib
-import aiohttp
 import urllib.parse
+from collections import OrderedDict
+from typing import List, Tuple
 from .ned import NED, TextOrSentences, sentences_to_text
 from .result import NedResult, NedResultEntity, NedResource
+from ..util.http import HttpClient
+from ..util.singleflight import SingleFlight
+from ..util.cache import TieredCache, MISSING
+from ..util.limiter import RateLimiter, parse_retry_after
 
 DEFAULT_EXPIRATION_SEC = 30 * 24 * 60 * 60 # 30 days
 
@@ -42,9 +48,21 @@ def as_ned_resource(item):
     wikipedia_uri = result.get('detailedDescription', {}).get('url', None)
   )
 
-def as_ned_result_entity(items, text):
+def get_items(response, query):
+  if 'itemListElement' not in response:
+    print('ERR: No "itemListElement" in response ({})'.format(query), response)
+
+  return response['itemListElement']
+
+def get_first_resource(response, query):
+  items = get_items(response, query)
+  return as_ned_resource(items[0]) if len(items) > 0 else None
+
+def strip_kg_prefix(id):
+  return id[3:] if id.startswith('kg:') else id
+
+def as_ned_result_entity(resources, text):
   start, end = 0, len(text)
-  resources = [as_ned_resource(i) for i in items]
 
   return NedResultEntity(
     entity = text[start:end],
@@ -56,88 +74,151 @@ def as_ned_result_entity(items, text):
   )
 
 MAX_ATTEMPTS = 5
+# IDs looked up in one request when expanding resources in bulk. The API
+# returns 20 results when no limit is given: a request for at most this
+# many IDs is never cut short, even if the limit is ignored.
+MAX_IDS_PER_REQUEST = 20
 
 class GoogleKnowledgeGraphNed(NED):
-  def __init__(self, cache = None):
+  '''
+  `cache` is either a `TieredCache` or a `diskcache.Cache`. Responses are
+  kept serialized in the disk tier and as parsed resources in the memory tier.
+
+  All calls to the API go through `limiter`. Failed calls (5xx and 429)
+  are retried after the delay it gives.
+  '''
+  def __init__(self, cache = None, http_client: HttpClient = None, limiter: RateLimiter = None):
     self._endpoint = 'https://content-kgsearch.googleapis.com/v1/entities:search?prefix=true&query={}&key={}'
-    self._id_endpoint = 'https://content-kgsearch.googleapis.com/v1/entities:search?prefix=true&ids={}&key={}'
+    self._ids_endpoint = 'https://content-kgsearch.googleapis.com/v1/entities:search?prefix=true&{}&limit={}&key={}'
     self._api_key = os.environ['GKG_API_KEY']
+    if cache is not None and not isinstance(cache, TieredCache):
+      cache = TieredCache(cache, expire_sec = DEFAULT_EXPIRATION_SEC)
     self._cache = cache
+    self._http_client = http_client if http_client is not None else HttpClient()
+    self._limiter = limiter if limiter is not None else RateLimiter()
+    # Concurrent lookups of the same text or ID share one request.
+    self._in_flight = SingleFlight()
 
   async def extract(self, text: TextOrSentences, **kwargs) -> NedResult:
     full_text = sentences_to_text(text)
-    attempt = kwargs.get('attempt', 0)
+
+    def parse(response):
+      return [as_ned_resource(i) for i in get_items(response, full_text)]
 
     cache_key = get_cache_key(full_text)
-    if self._cache and cache_key in self._cache:
-      # print('GKE Cache hit for "{}": {}'.format(full_text, cache_key))
-      response = json.loads(self._cache[cache_key])
-    else:
-      response, status = await self.get_gkg_response(full_text)
-      if status < 400:
-        self._cache.set(cache_key, json.dumps(response), expire = DEFAULT_EXPIRATION_SEC)
-
-      if status >= 500:
-        if attempt < MAX_ATTEMPTS:
-          # try again
-          return await self.extract(text, attempt = attempt + 1)
-        else:
+    resources = await self._in_flight.run(
+      cache_key,
+      lambda: self._get_resources(cache_key, self._get_url(full_text), parse)
+    )
+
+    return NedResult(full_text, [as_ned_result_entity(resources, full_text)])
+
+  async def _get_resources(self, cache_key, url, parse):
+    if self._cache is not None:
+      value = self._cache.get(cache_key, lambda serialized: parse(json.loads(serialized)))
+      if value is not MISSING:
+        return value
+
+    response = await self._get_response(url)
+    value = parse(response)
+    if self._cache is not None:
+      self._cache.set(cache_key, json.dumps(response), value)
+    return value
+
+  async def _get_response(self, url):
+    attempt = 0
+    while True:
+      response, status, retry_after = await self._fetch(url)
+
+      if status >= 500 or status == 429:
+        if attempt >= MAX_ATTEMPTS:
           raise Exception('Had {} attempts getting data. Failing for good. Last error ({}) {}'.format(attempt, status, json.dumps(response)))
+        # try again
+        await asyncio.sleep(self._limiter.retry_delay(attempt, retry_after))
+        attempt += 1
       elif status >= 400:
         raise Exception('Received an error from GKE ({}): {}'.format(status, json.dumps(response)))
+      else:
+        return response
 
-    if 'itemListElement' not in response:
-      print('ERR: No "itemListElement" in response ({})'.format(full_text), response)
+  async def _fetch(self, url):
+    '''
+    Response body, status and `Retry-After` delay (if any) of a GET request.
+    Bodies that are not JSON (e.g. an HTML error page) are returned as
+    `{ 'error': text }`.
+    '''
+    async with self._limiter:
+      async with self._http_client.session.get(url) as resp:
+        if resp.content_type == 'application/json':
+          body = await resp.json()
+        else:
+          body = { 'error': await resp.text() }
+        return body, resp.status, parse_retry_after(resp.headers.get('Retry-After'))
 
-    items = response['itemListElement']
+  def _get_url(self, text):
+    return self._endpoint.format(urllib.parse.quote(text), self._api_key)
 
-    return NedResult(full_text, [as_ned_result_entity(items, full_text)])
+  def _get_ids_url(self, ids):
+    query = '&'.join('ids={}'.format(urllib.parse.quote(strip_kg_prefix(id))) for id in ids)
+    # without a limit at most 20 results are returned
+    return self._ids_endpoint.format(query, len(ids), self._api_key)
 
+  def _get_id_url(self, id):
+    return self._get_ids_url([id])
 
   async def get_gkg_response(self, text):
-    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False)) as session:
-      url = self._endpoint.format(urllib.parse.quote(text), self._api_key)
-
-      async with session.get(url) as resp:
-        body = await resp.json()
-        return body, resp.status
+    body, status, _ = await self._fetch(self._get_url(text))
+    return body, status
 
   async def get_gkg_response_for_id(self, id):
-    id_val = id[3:] if id.startswith('kg:') else id
-    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False)) as session:
-      url = self._id_endpoint.format(urllib.parse.quote(id_val), self._api_key)
-
-      async with session.get(url) as resp:
-        body = await resp.json()
-        return body, resp.status
+    body, status, _ = await self._fetch(self._get_id_url(id))
+    return body, status
 
   async def expand_resource(self, model_name, resource_id, label = None, **kwargs) -> NedResource:
     '''
     TODO: Extract wiki page metadata if page is present.
     '''
-    attempt = kwargs.get('attempt', 0)
-
     cache_key = get_id_cache_key(resource_id)
-    if self._cache and cache_key in self._cache:
-      # print('GKE Cache hit for "{}": {}'.format(full_text, cache_key))
-      response = json.loads(self._cache[cache_key])
-    else:
-      response, status = await self.get_gkg_response_for_id(resource_id)
-      if status < 400:
-        self._cache.set(cache_key, json.dumps(response), expire = DEFAULT_EXPIRATION_SEC)
-
-      if status >= 500:
-        if attempt < MAX_ATTEMPTS:
-          # try again
-          return await self.expand_resource(model_name, resource_id, label, attempt = attempt + 1)
-        else:
-          raise Exception('Had {} attempts getting data. Failing for good. Last error ({}) {}'.format(attempt, status, json.dumps(response)))
-      elif status >= 400:
-        raise Exception('Received an error from GKE ({}): {}'.format(status, json.dumps(response)))
-
-    if 'itemListElement' not in response:
-      print('ERR: No "itemListElement" in response ({})'.format(id), response)
+    return await self._in_flight.run(
+      cache_key,
+      lambda: self._get_resources(cache_key, self._get_id_url(resource_id), lambda r: get_first_resource(r, resource_id))
+    )
 
-    items = response['itemListElement']
+  async def expand_resources(self, items: List[Tuple[str, str, str]]) -> List[NedResource]:
+    '''
+    Cached resources are read in bulk, the others are requested
+    `MAX_IDS_PER_REQUEST` IDs at a time.
+    '''
+    resource_ids = list(OrderedDict.fromkeys(resource_id for _, resource_id, _ in items))
+    cache_keys = OrderedDict((id, get_id_cache_key(id)) for id in resource_ids)
 
-    return as_ned_resource(items[0]) if len(items) > 0 else None
+    if self._cache is not None:
+      cached = self._cache.get_many(cache_keys.values(), lambda serialized: get_first_resource(json.loads(serialized), None))
+    else:
+      cached = {}
+
+    resources = { id: cached.get(cache_key, MISSING) for id, cache_key in cache_keys.items() }
+
+    missing_ids = [id for id, resource in resources.items() if resource is MISSING]
+    ids_chunks = [missing_ids[i:i + MAX_IDS_PER_REQUEST] for i in range(0, len(missing_ids), MAX_IDS_PER_REQUEST)]
+    for chunk_resources in await asyncio.gather(*[self._get_resources_by_ids(ids) for ids in ids_chunks]):
+      resources.update(chunk_resources)
+
+    return [resources[resource_id] for _, resource_id, _ in items]
+
+  async def _get_resources_by_ids(self, ids) -> dict:
+    response = await self._get_response(self._get_ids_url(ids))
+    items = get_items(response, ids)
+    items_by_id = { strip_kg_prefix(item['result']['@id']): item for item in items }
+    # a full page may have been cut short: IDs missing from it may exist
+    complete = len(items) < len(ids)
+
+    resources = {}
+    for id in ids:
+      item = items_by_id.get(strip_kg_prefix(id))
+      # cached the same way as a response for this ID only
+      id_response = { 'itemListElement': [item] if item is not None else [] }
+      resources[id] = get_first_resource(id_response, id)
+      if self._cache is not None and (item is not None or complete):
+        self._cache.set(get_id_cache_key(id), json.dumps(id_response), resources[id])
+    return resources
@@ -1,3 +1,4 @@
+import asyncio
 from typing import TypeVar, List, Tuple
 from segtok.segmenter import split_single
 
@@ -10,3 +11,13 @@ class NED:
 
   async def expand_resource(self, model_name, resource_id, label = None) -> NedResource:
     raise NotImplementedError()
+
+  async def expand_resources(self, items: List[Tuple[str, str, str]]) -> List[NedResource]:
+    '''
+    `expand_resource` for a list of `(model_name, resource_id, label)` items.
+    Results are in the same order as items.
+    '''
+    return await asyncio.gather(*[
+      self.expand_resource(model_name, resource_id, label)
+      for model_name, resource_id, label in items
+    ])
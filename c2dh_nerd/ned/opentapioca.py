@@ -1,6 +1,13 @@
-import aiohttp
+import json
+import bisect
+import hashlib
+from collections import OrderedDict
+from typing import List, Tuple
 from .ned import NED, TextOrSentences, sentences_to_text
 from .result import NedResult, NedResultEntity, NedResource
+from .gkg import DEFAULT_EXPIRATION_SEC
+from ..util.http import HttpClient
+from ..util.cache import TieredCache, MISSING
 
 
 # On tagging entities
@@ -55,24 +62,100 @@ def as_ned_result_entity(annotation, text):
     matched_resource = resources[0]
   )
 
+# Texts annotated in one request are separated by this.
+# It is not part of any entity.
+TEXTS_SEPARATOR = '\n\n'
+
+def get_cache_key(query):
+  query_hash = hashlib.blake2b(bytes(query, 'utf-8')).hexdigest()
+  return 'otr:{}'.format(query_hash)
+
+def pack_texts(texts: List[str]) -> Tuple[str, List[int]]:
+  '''
+  Texts joined into one query and the position of every text in it.
+  '''
+  starts = []
+  position = 0
+  for text in texts:
+    starts.append(position)
+    position += len(text) + len(TEXTS_SEPARATOR)
+  return TEXTS_SEPARATOR.join(texts), starts
+
+def split_annotations(annotations, texts: List[str], starts: List[int]) -> List[list]:
+  '''
+  Annotations of a packed query split by text, with positions relative to the text.
+  Annotations not within a single text are dropped.
+  '''
+  texts_annotations = [[] for _ in texts]
+  for annotation in annotations:
+    idx = bisect.bisect_right(starts, annotation['start']) - 1
+    if idx < 0:
+      continue
+    start = starts[idx]
+    if annotation['end'] <= start + len(texts[idx]):
+      texts_annotations[idx].append(dict(annotation, start = annotation['start'] - start, end = annotation['end'] - start))
+  return texts_annotations
+
+def as_ned_result(text, annotations):
+  return NedResult(text, [as_ned_result_entity(a, text) for a in annotations])
+
 class OpenTapiocaNed(NED):
-  def __init__(self):
+  '''
+  `extract_many` annotates several texts in one request. OpenTapioca
+  sees the other texts of the request as context, so only texts of the
+  same document are annotated together: `FusionNed` does it for the
+  mentions of a document, at most `max_batch_size` of them or those
+  submitted within `max_batch_wait_ms`.
+
+  `cache` is either a `TieredCache` or a `diskcache.Cache`. Annotations
+  are cached by request: texts get the same annotations only when they
+  are annotated together again.
+  '''
+  def __init__(self, http_client: HttpClient = None, cache = None, max_batch_size: int = 16, max_batch_wait_ms: float = 5):
     self._endpoint = 'https://opentapioca.org/api/annotate'
+    self._http_client = http_client if http_client is not None else HttpClient()
+    if cache is not None and not isinstance(cache, TieredCache):
+      cache = TieredCache(cache, expire_sec = DEFAULT_EXPIRATION_SEC)
+    self._cache = cache
+    self.max_batch_size = max_batch_size
+    self.max_batch_wait_ms = max_batch_wait_ms
 
   async def extract(self, text: TextOrSentences, **kwargs) -> NedResult:
     full_text = sentences_to_text(text)
-    opentapioca_response = await self.get_opentapioca_response(full_text)
+    results = await self.extract_many([full_text])
+    return results[0]
+
+  async def extract_many(self, texts: List[str]) -> List[NedResult]:
+    '''
+    One result per text. Texts are annotated together in one request.
+    '''
+    unique_texts = [t for t in OrderedDict.fromkeys(texts) if len(t) > 0]
+    if len(unique_texts) == 0:
+      return [NedResult(t, []) for t in texts]
+
+    annotations = dict(zip(unique_texts, await self._annotate(unique_texts)))
+    return [as_ned_result(t, annotations[t]) if t in annotations else NedResult(t, []) for t in texts]
+
+  async def _annotate(self, texts: List[str]) -> List[list]:
+    query, starts = pack_texts(texts)
+    cache_key = get_cache_key(query)
 
-    annotations = opentapioca_response['annotations']
+    annotations = MISSING
+    if self._cache is not None:
+      annotations = self._cache.get(cache_key, json.loads)
 
-    return NedResult(full_text, [as_ned_result_entity(a, full_text) for a in annotations])
+    if annotations is MISSING:
+      opentapioca_response = await self.get_opentapioca_response(query)
+      annotations = opentapioca_response['annotations']
+      if self._cache is not None:
+        self._cache.set(cache_key, json.dumps(annotations), annotations)
 
+    return split_annotations(annotations, texts, starts)
 
   async def get_opentapioca_response(self, text):
     req = {
       'query': text
     }
 
-    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False)) as session:
-      async with session.post(self._endpoint, data=req) as resp:
-        return await resp.json()
+    async with self._http_client.session.post(self._endpoint, data=req) as resp:
+      return await resp.json()
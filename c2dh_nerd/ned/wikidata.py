@@ -0,0 +1,193 @@
+import os
+import sys
+import mmap
+import struct
+import hashlib
+from typing import List
+from .ned import NED, TextOrSentences, sentences_to_text
+from .result import NedResult, NedResultEntity, NedResource
+from .opentapioca import WIKIDATA_QUALIFIER_TO_ENTITY_TYPE
+
+# Index file layout (little endian):
+#  * header: magic, number of entities, number of names
+#  * names: (hash of normalized label or alias, entity number), sorted
+#    by hash and then by entity rank, highest first
+#  * IDs: (hash of Wikidata ID, entity number), sorted by hash
+#  * offsets of entities records in the records section
+#  * records: "id\tlabel\tdescription\ttag\trank" UTF-8 encoded
+MAGIC = b'C2DHWD02'
+HEADER = struct.Struct('<8sQQ')
+HASH_ENTRY = struct.Struct('<QI')
+OFFSET = struct.Struct('<Q')
+
+MAX_RESOURCES = 10
+
+def normalize_label(text: str) -> str:
+  '''
+  Labels are looked up exactly, only ignoring case and spacing:
+  every word counts ("Malcolm X", "May", "IT").
+  '''
+  return ' '.join(text.casefold().split())
+
+def get_hash(value: str) -> int:
+  return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def get_tag_from_types(types: List[str]) -> str:
+  for qualifier, entity_type in WIKIDATA_QUALIFIER_TO_ENTITY_TYPE.items():
+    if qualifier in types:
+      return entity_type
+  return 'UNK'
+
+def build_index(extract_path: str, index_path: str):
+  '''
+  Build an index from a tab separated Wikidata extract with columns:
+  ID, label, aliases (separated by "|"), description, "instance of"
+  IDs (separated by ",") and rank (e.g. number of sitelinks, optional).
+  '''
+  records = []
+  names = []
+  ranks = []
+
+  with open(extract_path, encoding='utf-8') as f:
+    for line in f:
+      columns = line.rstrip('\n').split('\t')
+      if len(columns) < 5 or not columns[0].startswith('Q'):
+        continue
+      id, label, aliases, description, types = columns[:5]
+      rank = float(columns[5]) if len(columns) > 5 and columns[5] != '' else 0.0
+
+      entity = len(records)
+      tag = get_tag_from_types(types.split(','))
+      records.append('\t'.join([id, label, description, tag, str(rank)]).encode('utf-8'))
+      ranks.append(rank)
+
+      entity_names = set(normalize_label(n) for n in [label] + aliases.split('|'))
+      names += [(get_hash(n), entity) for n in entity_names if n != '']
+
+  names.sort(key=lambda n: (n[0], -ranks[n[1]], n[1]))
+  ids = sorted((get_hash(r.split(b'\t', 1)[0].decode('utf-8')), entity) for entity, r in enumerate(records))
+
+  tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+  with open(tmp_path, 'wb') as f:
+    f.write(HEADER.pack(MAGIC, len(records), len(names)))
+    for entry in names:
+      f.write(HASH_ENTRY.pack(*entry))
+    for entry in ids:
+      f.write(HASH_ENTRY.pack(*entry))
+    offset = 0
+    for record in records:
+      f.write(OFFSET.pack(offset))
+      offset += len(record)
+    f.write(OFFSET.pack(offset))
+    for record in records:
+      f.write(record)
+  os.replace(tmp_path, index_path)
+
+class WikidataIndex:
+  '''
+  Read-only, memory-mapped index built with `build_index`.
+  Pages are loaded by the OS as they are used and shared by all processes.
+  '''
+  def __init__(self, path: str):
+    self.path = path
+    with open(path, 'rb') as f:
+      self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, self.entities_count, self.names_count = HEADER.unpack_from(self._data, 0)
+    assert magic == MAGIC, 'Not a Wikidata index: {}'.format(path)
+
+    self._names_offset = HEADER.size
+    self._ids_offset = self._names_offset + self.names_count * HASH_ENTRY.size
+    self._offsets_offset = self._ids_offset + self.entities_count * HASH_ENTRY.size
+    self._records_offset = self._offsets_offset + (self.entities_count + 1) * OFFSET.size
+
+  def _find(self, section_offset: int, count: int, hash: int) -> List[int]:
+    '''
+    Entity numbers of all entries with this hash.
+    '''
+    low, high = 0, count
+    while low < high:
+      middle = (low + high) // 2
+      if HASH_ENTRY.unpack_from(self._data, section_offset + middle * HASH_ENTRY.size)[0] < hash:
+        low = middle + 1
+      else:
+        high = middle
+
+    entities = []
+    for position in range(low, count):
+      entry_hash, entity = HASH_ENTRY.unpack_from(self._data, section_offset + position * HASH_ENTRY.size)
+      if entry_hash != hash:
+        break
+      entities.append(entity)
+    return entities
+
+  def _get_record(self, entity: int) -> List[str]:
+    start, = OFFSET.unpack_from(self._data, self._offsets_offset + entity * OFFSET.size)
+    end, = OFFSET.unpack_from(self._data, self._offsets_offset + (entity + 1) * OFFSET.size)
+    return self._data[self._records_offset + start:self._records_offset + end].decode('utf-8').split('\t')
+
+  def get_by_name(self, name: str, limit: int) -> List[List[str]]:
+    '''
+    Records of entities with this label or alias, highest ranked first.
+    '''
+    normalized_name = normalize_label(name)
+    if normalized_name == '':
+      return []
+    entities = self._find(self._names_offset, self.names_count, get_hash(normalized_name))
+    return [self._get_record(e) for e in entities[:limit]]
+
+  def get_by_id(self, id: str) -> List[str]:
+    for entity in self._find(self._ids_offset, self.entities_count, get_hash(id)):
+      record = self._get_record(entity)
+      if record[0] == id:
+        return record
+    return None
+
+def as_ned_resource(record):
+  id, label, description, tag, rank = record
+  return NedResource(
+    score = float(rank),
+    model = 'wikidata',
+    id = id,
+    tag = tag,
+    label = label,
+    description = description,
+    wikidata_id = id,
+  )
+
+class WikidataNed(NED):
+  '''
+  Looks up entities by label and alias in a local Wikidata index,
+  without calling any remote service.
+  '''
+  def __init__(self, index_path: str):
+    assert index_path is not None, 'Wikidata index path must be provided'
+    self._index = WikidataIndex(index_path)
+
+  async def extract(self, text: TextOrSentences, **kwargs) -> NedResult:
+    full_text = sentences_to_text(text)
+    if len(full_text) == 0:
+      return NedResult(full_text, [])
+
+    resources = [as_ned_resource(r) for r in self._index.get_by_name(full_text, MAX_RESOURCES)]
+
+    entity = NedResultEntity(
+      entity = full_text,
+      score = 1.0,
+      left = 0,
+      right = len(full_text),
+      resources = resources,
+      matched_resource = resources[0] if len(resources) > 0 else None
+    )
+    return NedResult(full_text, [entity])
+
+  async def expand_resource(self, model_name, resource_id, label = None) -> NedResource:
+    record = self._index.get_by_id(resource_id)
+    if record is None and label is not None:
+      records = self._index.get_by_name(label, 1)
+      record = records[0] if len(records) > 0 else None
+    return as_ned_resource(record) if record is not None else None
+
+if __name__ == '__main__':
+  # python -m c2dh_nerd.ned.wikidata <extract.tsv> <index file>
+  build_index(sys.argv[1], sys.argv[2])
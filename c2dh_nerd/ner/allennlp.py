@@ -2,10 +2,12 @@ from typing import List, Tuple, Any
 from allennlp.predictors.predictor import Predictor
 from allennlp.models.archival import load_archive
 import torch
+from allennlp.version import VERSION as ALLENNLP_VERSION
 
 from .ner import NER, TextOrSentences, text_to_sentences, sentences_to_text
 from .result import NerResult, NerResultEntity
 from .mapping import ONTONOTES_TO_WIKIPEDIA_LABEL_MAPPING
+from ..util.executor import InferenceExecutor
 
 MODELS_MAPPING = {
   'fine-grained-ner': 'https://s3-us-west-2.amazonaws.com/allennlp/models/fine-grained-ner-model-elmo-2018.12.21.tar.gz',
@@ -70,7 +72,7 @@ def group_with_bioul(word_tag_token_items: List[Tuple[str, str, Any]]) -> List[T
   return groups
 
 class AllenNlpNer(NER):
-  def __init__(self, model_name: str = 'fine-grained-ner'):
+  def __init__(self, model_name: str = 'fine-grained-ner', executor: InferenceExecutor = None):
     assert model_name in MODELS_MAPPING, \
       'Unknown model name: "{}". Available models: {}'.format(model_name, ', '.join(MODELS_MAPPING.keys()))
     model_url = MODELS_MAPPING[model_name]
@@ -79,11 +81,21 @@ class AllenNlpNer(NER):
     except:
       cuda_device = -1
     self._predictor = Predictor.from_archive(load_archive(model_url, cuda_device=cuda_device))
+    self._model_url = model_url
+    super().__init__(model_name, executor=executor)
+
+  @property
+  def version(self) -> str:
+    return 'allennlp-{}:{}'.format(ALLENNLP_VERSION, self._model_url)
+
+  @property
+  def memory_size(self) -> int:
+    return sum(p.numel() * p.element_size() for p in self._predictor._model.parameters())
 
   async def extract(self, text: TextOrSentences) -> NerResult:
     full_text = sentences_to_text(text)
     sentences = text_to_sentences(text)
-    entities = self._extract(sentences)
+    entities = await self.run_inference(self._extract, sentences)
     return NerResult(full_text, entities)
 
   def _extract(self, sentences: List[Tuple[str, int]]):
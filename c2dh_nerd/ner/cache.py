@@ -0,0 +1,59 @@
+import json
+import hashlib
+
+from .ner import NER, TextOrSentences
+from .result import NerResult, NerResultEntity
+
+def get_cache_key(model_tag: str, model_version: str, text: TextOrSentences, kwargs: dict) -> str:
+  content = json.dumps([model_version, text, kwargs], sort_keys=True, ensure_ascii=False)
+  content_hash = hashlib.blake2b(bytes(content, 'utf-8')).hexdigest()
+  return 'ner:{}:{}'.format(model_tag, content_hash)
+
+def serialize_result(result: NerResult) -> str:
+  return json.dumps({
+    'text': result.text,
+    'entities': [e.__dict__ for e in result.entities]
+  }, ensure_ascii=False)
+
+def deserialize_result(serialized: str) -> NerResult:
+  result = json.loads(serialized)
+  return NerResult(result['text'], [NerResultEntity(**e) for e in result['entities']])
+
+class CachedNer(NER):
+  '''
+  Returns results for text the wrapped NER has already seen from a
+  `diskcache.Cache`. Results are keyed by model tag, model version
+  and a hash of the text, so a new model version never sees results
+  of the previous one.
+  '''
+  def __init__(self, ner: NER, model_tag: str, cache, expire_sec: float = None):
+    self._ner = ner
+    self._model_tag = model_tag
+    self._cache = cache
+    self._expire_sec = expire_sec
+
+  @property
+  def version(self):
+    return self._ner.version
+
+  @property
+  def memory_size(self):
+    return self._ner.memory_size
+
+  def close(self):
+    self._ner.close()
+
+  async def warm_up(self):
+    # the cache would answer instead of the model
+    await self._ner.warm_up()
+
+  async def extract(self, text: TextOrSentences, **kwargs) -> NerResult:
+    cache_key = get_cache_key(self._model_tag, self.version, text, kwargs)
+
+    serialized = self._cache.get(cache_key)
+    if serialized is not None:
+      return deserialize_result(serialized)
+
+    result = await self._ner.extract(text, **kwargs)
+    self._cache.set(cache_key, serialize_result(result), expire = self._expire_sec)
+    return result
@@ -1,37 +1,79 @@
 from typing import List, Tuple
+from collections import OrderedDict
+import flair
 from flair.data import Sentence
 from flair.models import SequenceTagger
 
 from .ner import NER, TextOrSentences, text_to_sentences, sentences_to_text
 from .result import NerResult, NerResultEntity
 from .mapping import ONTONOTES_TO_WIKIPEDIA_LABEL_MAPPING
+from ..util.executor import InferenceExecutor
+from ..util.batching import MicroBatcher
+from ..util.cache import LruCache, MISSING
 
 flatten = lambda l: [item for sublist in l for item in sublist]
 
-def as_ner_result_entity(span, offset: int, index: int, return_sentences = False) -> NerResultEntity:
+def as_ner_result_entity(span) -> NerResultEntity:
+  '''
+  Entity with positions relative to the sentence it was found in.
+  '''
   # print('S', span, dir(span), span.__dict__)
   # {'tokens': [Token: 5 Robert, Token: 6 Goebbels,], 'tag': 'PER', 'score': 0.8921127617359161, 'start_pos': 17, 'end_pos': 33}
-  left = span.start_pos if return_sentences else span.start_pos + offset
-  right = span.end_pos if return_sentences else span.end_pos + offset
-  sentence_index = index if return_sentences else None
   tag = ONTONOTES_TO_WIKIPEDIA_LABEL_MAPPING.get(span.tag, 'UNK') 
 
   return NerResultEntity(
     entity = span.text,
     tag = tag,
+    left = span.start_pos,
+    right = span.end_pos,
+    score = span.score
+  )
+
+def with_sentence_position(entity: NerResultEntity, offset: int, index: int, return_sentences = False) -> NerResultEntity:
+  left = entity.left if return_sentences else entity.left + offset
+  right = entity.right if return_sentences else entity.right + offset
+  sentence_index = index if return_sentences else None
+
+  return NerResultEntity(
+    entity = entity.entity,
+    tag = entity.tag,
     left = left,
     right = right,
-    score = span.score,
+    score = entity.score,
     sentence_index = sentence_index
   )
 
 class FlairNer(NER):
-  def __init__(self, model_name='ner-fast'):
+  '''
+  Sentences from concurrent `extract` calls are tagged together:
+  they are collected for up to `max_batch_wait_ms` milliseconds or until
+  there are `max_batch_size` of them and then sent to the tagger in one go.
+
+  If `sentence_cache` is provided, entities found in a sentence are kept
+  there and only sentences that are not in the cache are sent to the tagger.
+  '''
+  def __init__(self, model_name='ner-fast', executor: InferenceExecutor = None, max_batch_size: int = 32, max_batch_wait_ms: float = 5, sentence_cache: LruCache = None):
     self._tagger = SequenceTagger.load(model_name)
+    self._batcher = MicroBatcher(self._tag_batch, max_batch_size, max_batch_wait_ms)
+    self._sentence_cache = sentence_cache
+    super().__init__(model_name, executor=executor)
+
+  @property
+  def version(self) -> str:
+    return 'flair-{}:{}'.format(flair.__version__, self._init_args[0])
+
+  @property
+  def memory_size(self) -> int:
+    return sum(p.numel() * p.element_size() for p in self._tagger.parameters())
 
   async def extract(self, text: TextOrSentences, return_sentences = False) -> NerResult:
     sentences_and_offsets = text_to_sentences(text)
-    entities = self._extract_sentences(sentences_and_offsets, return_sentences)
+    sentences_entities = await self._tag([sentence for sentence, _ in sentences_and_offsets])
+
+    entities = flatten([
+      [with_sentence_position(e, offset, index, return_sentences) for e in sentence_entities]
+      for index, (sentence_entities, (_, offset)) in enumerate(zip(sentences_entities, sentences_and_offsets))
+    ])
 
     if return_sentences:
       result_text = [s for s, _ in sentences_and_offsets]
@@ -40,11 +82,35 @@ class FlairNer(NER):
 
     return NerResult(result_text, entities)
 
-  def _extract_sentences(self, sentence_and_offset_list: List[Tuple[str, int]], return_sentences = False):
-    flair_sentences = [Sentence(sentence) for sentence, _ in sentence_and_offset_list]
+  async def _tag(self, sentences: List[str]) -> List[List[NerResultEntity]]:
+    if self._sentence_cache is None:
+      return await self._batcher.submit(sentences)
+
+    cached_entities = [self._sentence_cache.get(sentence) for sentence in sentences]
+    # the same sentence may appear more than once in a document
+    uncached_sentences = list(OrderedDict.fromkeys([
+      sentence
+      for sentence, entities in zip(sentences, cached_entities)
+      if entities is MISSING
+    ]))
+
+    tagged_entities = dict(zip(uncached_sentences, await self._batcher.submit(uncached_sentences)))
+    for sentence, entities in tagged_entities.items():
+      self._sentence_cache.set(sentence, entities, size = len(sentence))
+
+    return [
+      entities if entities is not MISSING else tagged_entities[sentence]
+      for sentence, entities in zip(sentences, cached_entities)
+    ]
+
+  async def _tag_batch(self, sentences: List[str]) -> List[List[NerResultEntity]]:
+    return await self.run_inference(self._tag_sentences, sentences)
+
+  def _tag_sentences(self, sentences: List[str]) -> List[List[NerResultEntity]]:
+    flair_sentences = [Sentence(sentence) for sentence in sentences]
     self._tagger.predict(flair_sentences)
 
-    return flatten([
-      [as_ner_result_entity(s, offset, index, return_sentences) for s in flair_sentence.get_spans('ner')]
-      for index, (flair_sentence, (_, offset)) in enumerate(zip(flair_sentences, sentence_and_offset_list))
-    ])
+    return [
+      [as_ner_result_entity(s) for s in flair_sentence.get_spans('ner')]
+      for flair_sentence in flair_sentences
+    ]
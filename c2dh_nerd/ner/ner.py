@@ -2,6 +2,7 @@ from typing import TypeVar, List, Tuple
 from segtok.segmenter import split_single
 
 from .result import NerResult
+from ..util.executor import InferenceExecutor
 
 TextOrSentences = ('TextOrSentences', str, List[str])
 
@@ -35,7 +36,66 @@ def sentences_to_text(text: TextOrSentences) -> str:
     return text
   return ''.join(text)
 
+# Text models are warmed up with after loading.
+WARMUP_TEXT = 'Jean-Claude Juncker met Angela Merkel at the European Commission in Brussels.'
+
+# NER instances created in this process, keyed by class and constructor arguments.
+# Process pool workers forked from this process inherit them.
+_local_instances = {}
+
+def get_local_instance(cls, init_args):
+  key = (cls, init_args)
+  if key not in _local_instances:
+    _local_instances[key] = cls(*init_args)
+  return _local_instances[key]
+
 class NER:
+  def __init__(self, *init_args, executor: InferenceExecutor = None):
+    self._init_args = init_args
+    self._executor = executor
+    _local_instances.setdefault((type(self), init_args), self)
+
+  def __reduce__(self):
+    # When inference runs in a process pool only the constructor arguments
+    # are sent to the worker, which uses its own instance of the model.
+    return (get_local_instance, (type(self), self._init_args))
+
+  @property
+  def version(self) -> str:
+    '''
+    Identifies the model and the library version it runs with.
+    Results of different versions may differ.
+    '''
+    return '{}:{}'.format(type(self).__name__, ':'.join(str(a) for a in self._init_args))
+
+  @property
+  def memory_size(self) -> int:
+    '''
+    Bytes taken by the model if known, `None` otherwise.
+    '''
+    return None
+
+  def close(self):
+    '''
+    Release the model. The instance must not be used afterwards.
+    '''
+    key = (type(self), self._init_args)
+    if _local_instances.get(key) is self:
+      del _local_instances[key]
+    if self._executor is not None:
+      self._executor.shutdown()
+
+  async def run_inference(self, fn, *args):
+    if self._executor is None:
+      return fn(*args)
+    return await self._executor.run(fn, *args)
+
+  async def warm_up(self):
+    '''
+    Run one inference so that the first request does not pay for lazy initialisation.
+    '''
+    await self.extract(WARMUP_TEXT)
+
   async def extract(self, text: TextOrSentences) -> NerResult:
     raise NotImplementedError()
 
@@ -3,6 +3,7 @@ import spacy
 from .ner import NER, TextOrSentences, text_to_sentences, sentences_to_text
 from .result import NerResult, NerResultEntity
 from .mapping import ONTONOTES_TO_WIKIPEDIA_LABEL_MAPPING
+from ..util.executor import InferenceExecutor
 
 MODELS_MAPPING = {
   'small_en': 'en_core_web_sm',
@@ -20,14 +21,20 @@ def as_ner_result_entity(entity) -> NerResultEntity:
   )
 
 class SpacyNer(NER):
-  def __init__(self, model_name: str = 'small_en'):
+  def __init__(self, model_name: str = 'small_en', executor: InferenceExecutor = None):
     assert model_name in MODELS_MAPPING, \
       'Unknown model name: "{}". Available models: {}'.format(model_name, ', '.join(MODELS_MAPPING.keys()))
     self._model = spacy.load(MODELS_MAPPING[model_name])
+    super().__init__(model_name, executor=executor)
+
+  @property
+  def version(self) -> str:
+    meta = self._model.meta
+    return 'spacy-{}:{}-{}'.format(spacy.__version__, meta.get('name'), meta.get('version'))
 
   async def extract(self, text: TextOrSentences) -> NerResult:
     full_text = sentences_to_text(text)
-    entities = self._extract(full_text)
+    entities = await self.run_inference(self._extract, full_text)
     return NerResult(full_text, entities)
 
   def _extract(self, text: str):
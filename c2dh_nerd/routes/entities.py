@@ -1,10 +1,12 @@
 import re
+import asyncio
 from aiohttp import web
 from ..util.routes import json_dumps
 
 MODEL_NAMES = {
   '^opentapioca$': 'ned_opentapioca',
   '^gkg$': 'ned_gkg',
+  '^wikidata$': 'ned_wikidata',
   '^external:.*$': 'ned_custom_entities',
 }
 
@@ -21,6 +23,15 @@ async def load_handler(request):
     { 'headers': entities_set.headers }
   )
 
+async def refresh_handler(request):
+  body = await request.json()
+  url = body.get('url')
+
+  entities_store = request.app['entities_store']
+  stats = await entities_store.refresh(url)
+
+  return web.json_response(stats)
+
 async def search_handler(request):
   body = await request.json()
   url = body.get('url')
@@ -36,17 +47,56 @@ async def search_handler(request):
     dumps = json_dumps
   )
 
+def get_ned_model_name(model_name):
+  ned_models = [v for p, v in MODEL_NAMES.items() if p.match(model_name)]
+  ned_model_name = ned_models[0] if len(ned_models) > 0 else None
+  assert ned_model_name is not None, 'Unknown model name: {}'.format(model_name)
+  return ned_model_name
+
+async def expand_items(app, items):
+  '''
+  Expand `{model, id, label}` items. Items are grouped by
+  NED and every NED expands its items at once.
+  '''
+  assert isinstance(items, list), '"items" must be a list'
+
+  items_by_ned = {}
+  for idx, item in enumerate(items):
+    model_name = item.get('model')
+    assert item.get('id') is not None, '"ID" must be provided'
+    items_by_ned.setdefault(get_ned_model_name(model_name), []).append(idx)
+
+  async def expand(ned_model_name, indices):
+    ned_model = await app['models'].load(ned_model_name)
+    return await ned_model.expand_resources([
+      (items[i].get('model'), items[i].get('id'), items[i].get('label'))
+      for i in indices
+    ])
+
+  ned_groups = list(items_by_ned.items())
+  groups_entities = await asyncio.gather(*[expand(n, indices) for n, indices in ned_groups])
+
+  entities = [None] * len(items)
+  for (_, indices), group_entities in zip(ned_groups, groups_entities):
+    for idx, entity in zip(indices, group_entities):
+      entities[idx] = entity
+  return entities
+
 async def expand_handler(request):
   body = await request.json()
+
+  if 'items' in body:
+    entities = await expand_items(request.app, body.get('items'))
+    return web.json_response(
+      { 'entities': entities },
+      dumps = json_dumps
+    )
+
   model_name = body.get('model')
   resource_id = body.get('id')
   label = body.get('label')
 
-  ned_models = [v for p, v in MODEL_NAMES.items() if p.match(model_name)]
-  ned_model_name = ned_models[0] if len(ned_models) > 0 else None
-  assert ned_model_name is not None, 'Unknown model name: {}'.format(model_name)
-
-  ned_model = request.app[ned_model_name]()
+  ned_model = await request.app['models'].load(get_ned_model_name(model_name))
   
   assert resource_id is not None, '"ID" must be provided'
 
@@ -3,16 +3,22 @@ import json
 from timeit import default_timer as timer
 
 from ..ned import NED
-from ..util.routes import json_dumps
+from ..util.routes import json_dumps, process_documents, stream_documents
 
 METHODS = [
   'opentapioca',
   'gkg',
+  'wikidata',
   # 'fusion-spacy_large_en-gkg',
   'fusion-flair-gkg',
+  'fusion-flair-opentapioca',
+  'fusion-flair-wikidata',
   'custom_entities',
+  'custom_entities_gazetteer',
   'fusion-flair-custom_entities',
-  'fusion-flair-custom_entities-gkg'
+  'fusion-flair-custom_entities-gkg',
+  'fusion-flair-custom_entities-wikidata-gkg',
+  'fusion-custom_entities_gazetteer-flair-gkg'
 ]
 
 async def handler(request):
@@ -27,7 +33,7 @@ async def handler(request):
   assert method in METHODS, 'Unknown method "{}". Supported methods are: {}'.format(method, ', '.join(METHODS))
   assert text, '"text" must be provided'
 
-  ned: NED = request.app['ned_{}'.format(method)]()
+  ned: NED = await request.app['models'].load('ned_{}'.format(method))
 
   start = timer()
   result = await ned.extract(text, **extras)
@@ -40,3 +46,37 @@ async def handler(request):
     result,
     dumps = json_dumps
   )
+
+async def batch_handler(request):
+  body = await request.json()
+  method = body.get('method')
+  documents = body.get('documents')
+
+  extras = body.copy()
+  extras.pop('method', None)
+  extras.pop('documents', None)
+
+  assert method in METHODS, 'Unknown method "{}". Supported methods are: {}'.format(method, ', '.join(METHODS))
+
+  ned: NED = await request.app['models'].load('ned_{}'.format(method))
+
+  start = timer()
+  results = await process_documents(documents, lambda text: ned.extract(text, **extras))
+  end = timer()
+
+  return web.json_response(
+    { 'documents': results, 'time_elapsed_seconds': end - start },
+    dumps = json_dumps
+  )
+
+async def stream_handler(request):
+  method = request.query.get('method')
+
+  extras = dict(request.query)
+  extras.pop('method', None)
+
+  assert method in METHODS, 'Unknown method "{}". Supported methods are: {}'.format(method, ', '.join(METHODS))
+
+  ned: NED = await request.app['models'].load('ned_{}'.format(method))
+
+  return await stream_documents(request, lambda text: ned.extract(text, **extras))
@@ -3,7 +3,7 @@ import json
 from timeit import default_timer as timer
 
 from ..ner import NER
-from ..util.routes import json_dumps
+from ..util.routes import json_dumps, process_documents, stream_documents
 
 METHODS = [
   'flair',
@@ -21,7 +21,7 @@ async def handler(request):
   assert method in METHODS, 'Unknown method "{}". Supported methods are: {}'.format(method, ', '.join(METHODS))
   assert text, '"text" must be provided'
 
-  ner: NER = request.app['ner_{}'.format(method)]()
+  ner: NER = await request.app['models'].load('ner_{}'.format(method))
 
   start = timer()
   result = await ner.extract(text)
@@ -34,3 +34,30 @@ async def handler(request):
     result,
     dumps = json_dumps
   )
+
+async def batch_handler(request):
+  body = await request.json()
+  method = body.get('method')
+  documents = body.get('documents')
+
+  assert method in METHODS, 'Unknown method "{}". Supported methods are: {}'.format(method, ', '.join(METHODS))
+
+  ner: NER = await request.app['models'].load('ner_{}'.format(method))
+
+  start = timer()
+  results = await process_documents(documents, ner.extract)
+  end = timer()
+
+  return web.json_response(
+    { 'documents': results, 'time_elapsed_seconds': end - start },
+    dumps = json_dumps
+  )
+
+async def stream_handler(request):
+  method = request.query.get('method')
+
+  assert method in METHODS, 'Unknown method "{}". Supported methods are: {}'.format(method, ', '.join(METHODS))
+
+  ner: NER = await request.app['models'].load('ner_{}'.format(method))
+
+  return await stream_documents(request, ner.extract)
@@ -1,4 +1,29 @@
+import os
 from aiohttp import web
+from ..util.routes import json_dumps
+from ..context import is_ready
 
 async def handler(request):
-  return web.json_response({ 'ok': 1 })
+  return web.json_response(
+    {
+      'ok': 1,
+      'pid': os.getpid(),
+      'cache': request.app['ned_cache'].stats(),
+      'limiters': { name: limiter.stats() for name, limiter in request.app['limiters'].items() },
+      'models': request.app['models'].stats()
+    },
+    dumps = json_dumps
+  )
+
+async def ready_handler(request):
+  '''
+  Ready once all preloaded models are loaded and warmed up.
+  '''
+  ready = is_ready(request.app)
+  return web.json_response(
+    {
+      'ready': 1 if ready else 0,
+      'models': request.app['readiness']
+    },
+    status = 200 if ready else 503
+  )
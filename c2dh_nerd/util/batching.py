@@ -0,0 +1,64 @@
+import asyncio
+from typing import Callable, Awaitable, List, Any
+
+class MicroBatcher:
+  '''
+  Collects items submitted by concurrent callers and processes them together.
+
+  A batch is processed once it has at least `max_batch_size` items or
+  `max_wait_ms` milliseconds after its first item was submitted.
+  `process_batch` receives the combined list of items and must return
+  one result per item, in the same order.
+  '''
+  def __init__(self, process_batch: Callable[[List[Any]], Awaitable[List[Any]]], max_batch_size: int = 32, max_wait_ms: float = 5):
+    assert max_batch_size > 0, 'Batch size must be greater than 0'
+    self._process_batch = process_batch
+    self.max_batch_size = max_batch_size
+    self.max_wait_ms = max_wait_ms
+    self._pending = []
+    self._pending_count = 0
+    self._timer = None
+
+  async def submit(self, items: List[Any]) -> List[Any]:
+    if len(items) == 0:
+      return []
+
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+    self._pending.append((items, future))
+    self._pending_count += len(items)
+
+    if self._pending_count >= self.max_batch_size:
+      self._flush()
+    elif self._timer is None:
+      self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+
+    return await future
+
+  def _flush(self):
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+
+    batch = self._pending
+    self._pending = []
+    self._pending_count = 0
+
+    if len(batch) > 0:
+      asyncio.ensure_future(self._run(batch))
+
+  async def _run(self, batch):
+    items = [item for batch_items, _ in batch for item in batch_items]
+    try:
+      results = await self._process_batch(items)
+    except Exception as err:
+      for _, future in batch:
+        if not future.done():
+          future.set_exception(err)
+      return
+
+    position = 0
+    for batch_items, future in batch:
+      if not future.done():
+        future.set_result(results[position:position + len(batch_items)])
+      position += len(batch_items)
@@ -0,0 +1,145 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Any
+
+# Returned by cache lookups when there is no value for the key.
+# `None` is a valid cached value.
+MISSING = object()
+
+class LruCache:
+  '''
+  In-process cache of up to `max_size` units (usually bytes of the
+  serialized value) that evicts least recently used values first.
+  Values expire `ttl_sec` seconds after they were added unless
+  `set` is given an explicit expiration time.
+  '''
+  def __init__(self, max_size: int, ttl_sec: float = None):
+    self.max_size = max_size
+    self.ttl_sec = ttl_sec
+    self.size = 0
+    self.hits = 0
+    self.misses = 0
+    self._items = OrderedDict()
+
+  def __len__(self):
+    return len(self._items)
+
+  def get(self, key, default = MISSING):
+    item = self._items.get(key)
+    if item is not None and item[2] is not None and item[2] < time.time():
+      self._remove(key)
+      item = None
+
+    if item is None:
+      self.misses += 1
+      return default
+
+    self.hits += 1
+    self._items.move_to_end(key)
+    return item[0]
+
+  def set(self, key, value, size: int = 1, expire_at: float = None):
+    if key in self._items:
+      self._remove(key)
+    if size > self.max_size:
+      return
+
+    if expire_at is None and self.ttl_sec is not None:
+      expire_at = time.time() + self.ttl_sec
+
+    self._items[key] = (value, size, expire_at)
+    self.size += size
+
+    while self.size > self.max_size:
+      oldest_key = next(iter(self._items))
+      self._remove(oldest_key)
+
+  def _remove(self, key):
+    _, size, _ = self._items.pop(key)
+    self.size -= size
+
+  def clear(self):
+    self._items.clear()
+    self.size = 0
+
+  def stats(self):
+    return {
+      'items': len(self._items),
+      'size': self.size,
+      'max_size': self.max_size,
+      'hits': self.hits,
+      'misses': self.misses,
+    }
+
+class TieredCache:
+  '''
+  Serialized values are kept in a `diskcache.Cache`.
+  Values parsed from them are kept in an `LruCache` in front of it,
+  so that hot keys are neither read from disk nor parsed again.
+  '''
+  def __init__(self, disk, memory: LruCache = None, expire_sec: float = None):
+    self.disk = disk
+    self.memory = memory
+    self.expire_sec = expire_sec
+    self.disk_hits = 0
+    self.disk_misses = 0
+
+  def get(self, key, parse: Callable[[str], Any]):
+    if self.memory is not None:
+      value = self.memory.get(key)
+      if value is not MISSING:
+        return value
+
+    serialized, expire_at = self.disk.get(key, default=None, expire_time=True)
+    if serialized is None:
+      self.disk_misses += 1
+      return MISSING
+    self.disk_hits += 1
+
+    value = parse(serialized)
+    if self.memory is not None:
+      self.memory.set(key, value, size = len(serialized), expire_at = expire_at)
+    return value
+
+  def get_many(self, keys, parse: Callable[[str], Any]) -> dict:
+    '''
+    Values by key, `MISSING` for keys that are not cached.
+    Keys not in memory are read from disk in one transaction.
+    '''
+    values = {}
+    for key in keys:
+      values[key] = self.memory.get(key) if self.memory is not None else MISSING
+
+    missing_keys = [k for k, v in values.items() if v is MISSING]
+    if len(missing_keys) == 0:
+      return values
+
+    with self.disk.transact():
+      serialized_values = [(k, self.disk.get(k, default=None, expire_time=True)) for k in missing_keys]
+
+    for key, (serialized, expire_at) in serialized_values:
+      if serialized is None:
+        self.disk_misses += 1
+        continue
+      self.disk_hits += 1
+
+      value = parse(serialized)
+      if self.memory is not None:
+        self.memory.set(key, value, size = len(serialized), expire_at = expire_at)
+      values[key] = value
+    return values
+
+  def set(self, key, serialized: str, value):
+    self.disk.set(key, serialized, expire = self.expire_sec)
+    if self.memory is not None:
+      expire_at = time.time() + self.expire_sec if self.expire_sec is not None else None
+      self.memory.set(key, value, size = len(serialized), expire_at = expire_at)
+
+  def stats(self):
+    return {
+      'memory': self.memory.stats() if self.memory is not None else None,
+      'disk': {
+        'hits': self.disk_hits,
+        'misses': self.disk_misses,
+      }
+    }
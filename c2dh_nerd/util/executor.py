@@ -0,0 +1,51 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+EXECUTOR_KINDS = ['thread', 'process']
+
+class InferenceQueueFull(Exception):
+  pass
+
+class InferenceExecutor:
+  '''
+  Runs blocking model inference outside of the event loop.
+
+  At most `max_workers` calls run at the same time and at most
+  `max_queue_size` calls wait for a free worker. Calls beyond that
+  are rejected with `InferenceQueueFull`.
+  '''
+  def __init__(self, kind: str = 'thread', max_workers: int = 1, max_queue_size: int = 16):
+    assert kind in EXECUTOR_KINDS, \
+      'Unknown executor kind: "{}". Available kinds: {}'.format(kind, ', '.join(EXECUTOR_KINDS))
+    assert max_workers > 0, 'At least 1 worker is required'
+    self.kind = kind
+    self.max_workers = max_workers
+    self.max_queue_size = max_queue_size
+    self._pending = 0
+    self._pool = None
+
+  def _get_pool(self):
+    if self._pool is None:
+      pool_class = ProcessPoolExecutor if self.kind == 'process' else ThreadPoolExecutor
+      self._pool = pool_class(max_workers=self.max_workers)
+    return self._pool
+
+  @property
+  def pending(self):
+    return self._pending
+
+  async def run(self, fn, *args):
+    if self._pending >= self.max_workers + self.max_queue_size:
+      raise InferenceQueueFull('Inference queue is full ({} calls pending)'.format(self._pending))
+
+    self._pending += 1
+    try:
+      loop = asyncio.get_event_loop()
+      return await loop.run_in_executor(self._get_pool(), fn, *args)
+    finally:
+      self._pending -= 1
+
+  def shutdown(self):
+    if self._pool is not None:
+      self._pool.shutdown(wait=False)
+      self._pool = None
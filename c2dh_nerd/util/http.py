@@ -0,0 +1,35 @@
+import aiohttp
+
+class HttpClient:
+  '''
+  HTTP client session shared by everything that talks to remote services.
+  Connections are pooled and kept alive between requests.
+  The session is created on first use, from within the running event loop.
+  `timeout_sec` limits API calls, file downloads set their own timeout.
+  '''
+  def __init__(self, limit: int = 100, limit_per_host: int = 16, timeout_sec: float = 30, keepalive_timeout_sec: float = 30):
+    self.limit = limit
+    self.limit_per_host = limit_per_host
+    self.timeout_sec = timeout_sec
+    self.keepalive_timeout_sec = keepalive_timeout_sec
+    self._session = None
+
+  @property
+  def session(self) -> aiohttp.ClientSession:
+    if self._session is None or self._session.closed:
+      connector = aiohttp.TCPConnector(
+        verify_ssl = False,
+        limit = self.limit,
+        limit_per_host = self.limit_per_host,
+        keepalive_timeout = self.keepalive_timeout_sec
+      )
+      self._session = aiohttp.ClientSession(
+        connector = connector,
+        timeout = aiohttp.ClientTimeout(total = self.timeout_sec)
+      )
+    return self._session
+
+  async def close(self):
+    if self._session is not None:
+      await self._session.close()
+      self._session = None
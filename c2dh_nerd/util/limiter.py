@@ -0,0 +1,134 @@
+import time
+import random
+import asyncio
+import email.utils
+
+def parse_retry_after(value: str) -> float:
+  '''
+  Seconds to wait from a `Retry-After` header: either a number
+  of seconds or an HTTP date. `None` if it cannot be parsed.
+  '''
+  if value is None:
+    return None
+  value = value.strip()
+  if value.isdigit():
+    return float(value)
+  try:
+    retry_at = email.utils.parsedate_to_datetime(value)
+  except (TypeError, ValueError):
+    return None
+  if retry_at is None:
+    return None
+  return max(retry_at.timestamp() - time.time(), 0)
+
+class RateLimiter:
+  '''
+  Limits calls to a remote service, shared by all requests in the process:
+
+    async with limiter:
+      ... call the service ...
+
+  At most `max_in_flight` calls run at the same time and calls are
+  started at no more than `rate_per_sec` per second, allowing bursts
+  of `burst` calls (token bucket). `None` means no limit.
+
+  `retry_delay` gives the time to wait before retrying a failed call:
+  exponential backoff with full jitter or the time the service asked
+  for in `Retry-After`, at most `backoff_max_sec`. In the latter case
+  no call is started before that time.
+  '''
+  def __init__(self, max_in_flight: int = None, rate_per_sec: float = None, burst: int = 1,
+               backoff_base_sec: float = 0.5, backoff_max_sec: float = 30):
+    self.max_in_flight = max_in_flight
+    self.rate_per_sec = rate_per_sec
+    self.burst = burst
+    self.backoff_base_sec = backoff_base_sec
+    self.backoff_max_sec = backoff_max_sec
+
+    self._semaphore = None
+    self._tokens = float(burst)
+    self._tokens_updated_at = time.monotonic()
+    self._paused_until = 0
+
+    self.in_flight = 0
+    self.waiting = 0
+    self.calls = 0
+    self.retries = 0
+    self.throttled = 0
+    self.queue_delay_sec_total = 0.0
+    self.queue_delay_sec_max = 0.0
+
+  def _get_semaphore(self):
+    # created on first use, from within the running event loop
+    if self._semaphore is None and self.max_in_flight is not None:
+      self._semaphore = asyncio.Semaphore(self.max_in_flight)
+    return self._semaphore
+
+  async def _take_token(self):
+    while True:
+      now = time.monotonic()
+
+      if now < self._paused_until:
+        await asyncio.sleep(self._paused_until - now)
+        continue
+
+      if self.rate_per_sec is None:
+        return
+
+      self._tokens = min(self._tokens + (now - self._tokens_updated_at) * self.rate_per_sec, self.burst)
+      self._tokens_updated_at = now
+      if self._tokens >= 1:
+        self._tokens -= 1
+        return
+      await asyncio.sleep((1 - self._tokens) / self.rate_per_sec)
+
+  async def __aenter__(self):
+    started_at = time.monotonic()
+    self.waiting += 1
+    semaphore = self._get_semaphore()
+    try:
+      if semaphore is not None:
+        await semaphore.acquire()
+      try:
+        await self._take_token()
+      except:
+        if semaphore is not None:
+          semaphore.release()
+        raise
+    finally:
+      self.waiting -= 1
+
+    queue_delay = time.monotonic() - started_at
+    self.calls += 1
+    self.in_flight += 1
+    self.queue_delay_sec_total += queue_delay
+    self.queue_delay_sec_max = max(self.queue_delay_sec_max, queue_delay)
+    return self
+
+  async def __aexit__(self, *args):
+    self.in_flight -= 1
+    if self._semaphore is not None:
+      self._semaphore.release()
+
+  def retry_delay(self, attempt: int, retry_after: float = None) -> float:
+    '''
+    Seconds to wait before retry number `attempt` (starting at 0).
+    '''
+    self.retries += 1
+    if retry_after is not None:
+      self.throttled += 1
+      retry_after = min(retry_after, self.backoff_max_sec)
+      self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+      return retry_after
+    return random.uniform(0, min(self.backoff_max_sec, self.backoff_base_sec * 2 ** attempt))
+
+  def stats(self) -> dict:
+    return {
+      'in_flight': self.in_flight,
+      'waiting': self.waiting,
+      'calls': self.calls,
+      'retries': self.retries,
+      'throttled': self.throttled,
+      'queue_delay_sec_mean': self.queue_delay_sec_total / self.calls if self.calls > 0 else 0,
+      'queue_delay_sec_max': self.queue_delay_sec_max
+    }
@@ -0,0 +1,79 @@
+import os
+import time
+import socket
+import signal
+import logging
+from typing import Callable
+
+def create_socket(port: int, host: str = '0.0.0.0', backlog: int = 128) -> socket.socket:
+  '''
+  Listening socket shared by all workers. The kernel distributes
+  incoming connections between the processes accepting on it.
+  '''
+  sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  sock.bind((host, port))
+  sock.listen(backlog)
+  sock.setblocking(False)
+  return sock
+
+def run_workers(workers: int, run_worker: Callable[[], None]):
+  '''
+  Fork `workers` processes running `run_worker` and wait for them.
+  Workers that exit unexpectedly are replaced. SIGINT and SIGTERM are
+  passed on to the workers, and this function returns once they have
+  all exited.
+
+  Workers share the memory of this process as it was when they were
+  forked (copy-on-write): anything loaded before is loaded only once.
+  '''
+  children = set()
+  stopping = { 'v': False }
+
+  def spawn():
+    pid = os.fork()
+    if pid == 0:
+      # worker: default signal handling, the server installs its own
+      signal.signal(signal.SIGINT, signal.SIG_DFL)
+      signal.signal(signal.SIGTERM, signal.SIG_DFL)
+      exit_code = 0
+      try:
+        run_worker()
+      except BaseException:
+        logging.exception('Worker {} failed'.format(os.getpid()))
+        exit_code = 1
+      finally:
+        os._exit(exit_code)
+    children.add(pid)
+    logging.info('Started worker {}'.format(pid))
+
+  def stop(signum, frame):
+    stopping['v'] = True
+    for pid in list(children):
+      try:
+        os.kill(pid, signal.SIGTERM)
+      except ProcessLookupError:
+        pass
+
+  signal.signal(signal.SIGINT, stop)
+  signal.signal(signal.SIGTERM, stop)
+
+  for _ in range(workers):
+    spawn()
+
+  while len(children) > 0:
+    try:
+      pid, status = os.wait()
+    except ChildProcessError:
+      break
+    except InterruptedError:
+      continue
+    children.discard(pid)
+
+    if not stopping['v']:
+      logging.warning('Worker {} exited with status {}, starting a new one'.format(pid, status))
+      # do not spin if workers fail right away
+      time.sleep(1)
+      # signalled while sleeping: the other workers are already stopping
+      if not stopping['v']:
+        spawn()
@@ -0,0 +1,214 @@
+import os
+import gc
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+def get_rss_bytes() -> int:
+  '''
+  Resident memory of this process. `None` where it cannot be read.
+  '''
+  try:
+    with open('/proc/self/statm') as f:
+      return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+  except (OSError, ValueError):
+    return None
+
+class ModelRegistry:
+  '''
+  NER and NED instances by tag, created on first use.
+
+  Instances registered as `evictable` count towards `memory_budget`
+  (bytes). Their size is the `memory_size` they report or, if they do
+  not, the growth of the process resident memory while they were being
+  created (an estimate if other models load at the same time). When
+  the budget is exceeded or an instance has not been used for
+  `idle_ttl_sec` seconds, least recently used instances are evicted
+  and created again on next use.
+
+  Instances requested while another instance is being created (e.g. the
+  NER of a fusion NED) are its dependencies: using an instance keeps
+  its dependencies in use too, and evicting a dependency evicts the
+  instances depending on it.
+
+  Concurrent requests for an instance that is being created wait for it
+  instead of creating it again.
+  '''
+  def __init__(self, memory_budget: int = None, idle_ttl_sec: float = None):
+    self.memory_budget = memory_budget
+    self.idle_ttl_sec = idle_ttl_sec
+
+    self._constructors = {}
+    self._evictable = set()
+    # tag -> instance, least recently used first
+    self._instances = OrderedDict()
+    self._sizes = {}
+    self._last_used = {}
+    self._dependencies = {}
+    self._metrics = {}
+
+    self._lock = threading.RLock()
+    self._load_locks = {}
+    self._local = threading.local()
+
+  def register(self, tag: str, constructor: Callable[[], object], evictable: bool = False):
+    self._constructors[tag] = constructor
+    if evictable:
+      self._evictable.add(tag)
+    self._metrics[tag] = {
+      'loads': 0,
+      'evictions': 0,
+      'load_time_sec_last': None,
+      'load_time_sec_total': 0.0,
+    }
+
+  def factory(self, tag: str) -> Callable[[], object]:
+    return lambda: self.get(tag)
+
+  def pin(self, tag: str):
+    '''
+    Never evict this instance and its dependencies.
+    '''
+    self._evictable.discard(tag)
+    for dependency in self._dependencies.get(tag, ()):
+      self.pin(dependency)
+
+  def __contains__(self, tag):
+    return tag in self._constructors
+
+  def is_loaded(self, tag: str) -> bool:
+    return tag in self._instances
+
+  def get(self, tag: str):
+    assert tag in self._constructors, 'Unknown model "{}"'.format(tag)
+
+    loading = getattr(self._local, 'loading', [])
+    if len(loading) > 0:
+      self._dependencies[loading[-1]].add(tag)
+
+    with self._lock:
+      instance = self._instances.get(tag)
+      if instance is not None:
+        self._touch(tag)
+        return instance
+      load_lock = self._load_locks.setdefault(tag, threading.Lock())
+
+    with load_lock:
+      with self._lock:
+        instance = self._instances.get(tag)
+        if instance is not None:
+          self._touch(tag)
+          return instance
+      instance = self._load(tag)
+
+    with self._lock:
+      self._instances[tag] = instance
+      self._touch(tag)
+      self._evict(keep = tag)
+    return instance
+
+  async def load(self, tag: str):
+    '''
+    `get` that creates the instance outside of the event loop.
+    '''
+    with self._lock:
+      instance = self._instances.get(tag)
+      if instance is not None:
+        self._touch(tag)
+        self._evict(keep = tag)
+        return instance
+
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, self.get, tag)
+
+  def _load(self, tag: str):
+    loading = getattr(self._local, 'loading', None)
+    if loading is None:
+      loading = self._local.loading = []
+
+    self._dependencies[tag] = set()
+    loaded_before = set(self._instances.keys())
+    rss_before = get_rss_bytes()
+    started_at = time.time()
+
+    loading.append(tag)
+    try:
+      instance = self._constructors[tag]()
+    finally:
+      loading.pop()
+
+    load_time = time.time() - started_at
+    metrics = self._metrics[tag]
+    metrics['loads'] += 1
+    metrics['load_time_sec_last'] = load_time
+    metrics['load_time_sec_total'] += load_time
+
+    size = getattr(instance, 'memory_size', None)
+    if size is None and rss_before is not None:
+      # dependencies loaded along with the instance have their own size
+      dependencies_size = sum(self._sizes.get(d, 0) for d in self._dependencies[tag] if d not in loaded_before)
+      size = max(get_rss_bytes() - rss_before - dependencies_size, 0)
+    self._sizes[tag] = size or 0
+
+    logging.info('Loaded model "{}" in {:.1f}s ({} bytes)'.format(tag, load_time, self._sizes[tag]))
+    return instance
+
+  def _touch(self, tag: str, now: float = None):
+    now = now if now is not None else time.time()
+    self._last_used[tag] = now
+    if tag in self._instances:
+      self._instances.move_to_end(tag)
+    for dependency in self._dependencies.get(tag, ()):
+      self._touch(dependency, now)
+
+  @property
+  def used_memory(self) -> int:
+    return sum(self._sizes.get(t, 0) for t in self._instances.keys() if t in self._evictable)
+
+  def _evict(self, keep: str = None):
+    now = time.time()
+    kept = set([keep]) | self._dependencies.get(keep, set()) if keep is not None else set()
+    evicted = False
+
+    for tag in list(self._instances.keys()):
+      if tag not in self._evictable or tag in kept or tag not in self._instances:
+        continue
+      over_budget = self.memory_budget is not None and self.used_memory > self.memory_budget
+      idle = self.idle_ttl_sec is not None and now - self._last_used.get(tag, 0) > self.idle_ttl_sec
+      if over_budget or idle:
+        self._unload(tag)
+        evicted = True
+
+    if evicted:
+      gc.collect()
+
+  def _unload(self, tag: str):
+    # instances depending on this one go first
+    for dependent in [t for t, deps in self._dependencies.items() if tag in deps and t in self._instances]:
+      self._unload(dependent)
+
+    instance = self._instances.pop(tag)
+    self._metrics[tag]['evictions'] += 1
+    logging.info('Evicted model "{}"'.format(tag))
+    if hasattr(instance, 'close'):
+      instance.close()
+
+  def stats(self) -> dict:
+    now = time.time()
+    return {
+      'memory_budget': self.memory_budget,
+      'used_memory': self.used_memory,
+      'models': {
+        tag: dict(
+          metrics,
+          loaded = tag in self._instances,
+          size = self._sizes.get(tag),
+          idle_sec = now - self._last_used[tag] if tag in self._last_used else None
+        )
+        for tag, metrics in self._metrics.items()
+        if metrics['loads'] > 0
+      }
+    }
@@ -1,3 +1,133 @@
+import os
 import json
+import asyncio
+from typing import Callable, Awaitable, List
+from aiohttp import web
 
 json_dumps = lambda x: json.dumps(x, default=lambda o: {k: v for k, v in o.__dict__.items() if v is not None}, ensure_ascii=False)
+
+# Number of documents of a batch request processed concurrently.
+DOCUMENTS_BATCH_SIZE = int(os.environ.get('DOCUMENTS_BATCH_SIZE', 16))
+MAX_BATCH_DOCUMENTS = int(os.environ.get('MAX_BATCH_DOCUMENTS', 1000))
+# Largest request body accepted, in megabytes. Must fit a batch of `MAX_BATCH_DOCUMENTS`.
+MAX_REQUEST_SIZE_MB = int(os.environ.get('MAX_REQUEST_SIZE_MB', 64))
+# Number of documents of a streaming request processed concurrently.
+STREAM_CONCURRENCY = int(os.environ.get('STREAM_CONCURRENCY', 16))
+# Longest line of a streaming request, in bytes. A document of a stream may be as large as a request.
+MAX_STREAM_LINE_SIZE = MAX_REQUEST_SIZE_MB * 1024 * 1024
+STREAM_READ_CHUNK_SIZE = 64 * 1024
+
+def format_error(err: Exception) -> str:
+  if isinstance(err, AssertionError):
+    return str(err)
+  return '{}: {}'.format(err.__class__.__name__, str(err))
+
+async def process_document(document: dict, extract: Callable[[str], Awaitable[object]]) -> dict:
+  '''
+  Run `extract` on the text of a document. A failure is reported
+  in the `error` slot of the document result.
+  '''
+  document_id = document.get('id') if isinstance(document, dict) else None
+  try:
+    assert isinstance(document, dict), 'Document must be an object'
+    text = document.get('text')
+    assert text, '"text" must be provided'
+    return { 'id': document_id, 'result': await extract(text) }
+  except Exception as err:
+    return { 'id': document_id, 'error': format_error(err) }
+
+async def process_documents(documents: List[dict], extract: Callable[[str], Awaitable[object]]) -> List[dict]:
+  assert isinstance(documents, list), '"documents" must be a list'
+  assert len(documents) <= MAX_BATCH_DOCUMENTS, \
+    'Too many documents ({}). At most {} are allowed'.format(len(documents), MAX_BATCH_DOCUMENTS)
+
+  results = []
+  for idx in range(0, len(documents), DOCUMENTS_BATCH_SIZE):
+    batch = documents[idx:idx + DOCUMENTS_BATCH_SIZE]
+    results += await asyncio.gather(*[process_document(d, extract) for d in batch])
+  return results
+
+async def read_lines(content, max_line_size: int):
+  '''
+  Split a request body into lines without buffering more than
+  `max_line_size` bytes. Longer lines are skipped and yielded as `None`.
+  '''
+  line = bytearray()
+  oversized = False
+  async for chunk in content.iter_chunked(STREAM_READ_CHUNK_SIZE):
+    start = 0
+    end = chunk.find(b'\n')
+    while end >= 0:
+      if oversized or len(line) + end - start > max_line_size:
+        yield None
+      else:
+        line += chunk[start:end]
+        yield bytes(line)
+      line = bytearray()
+      oversized = False
+      start = end + 1
+      end = chunk.find(b'\n', start)
+
+    if not oversized:
+      line += chunk[start:]
+      if len(line) > max_line_size:
+        line = bytearray()
+        oversized = True
+
+  if oversized:
+    yield None
+  elif len(line) > 0:
+    yield bytes(line)
+
+async def stream_documents(request: web.Request, extract: Callable[[str], Awaitable[object]]) -> web.StreamResponse:
+  '''
+  Read newline delimited JSON documents from the request body and write
+  a result line for every document as soon as it is ready. Results are
+  written in the order they complete, not in the order of the input.
+  At most `STREAM_CONCURRENCY` documents are read ahead of their results.
+  Documents still in progress are cancelled if the client goes away.
+  '''
+  response = web.StreamResponse(headers={ 'Content-Type': 'application/x-ndjson' })
+  await response.prepare(request)
+
+  slots = asyncio.Semaphore(STREAM_CONCURRENCY)
+  write_lock = asyncio.Lock()
+  tasks = set()
+
+  async def process_line(line_number, line):
+    try:
+      try:
+        assert line is not None, 'Line is longer than {} bytes'.format(MAX_STREAM_LINE_SIZE)
+        document = json.loads(line.decode('utf-8'))
+      except (AssertionError, ValueError) as err:
+        result = { 'id': None, 'line': line_number, 'error': format_error(err) }
+      else:
+        result = await process_document(document, extract)
+
+      async with write_lock:
+        await response.write((json_dumps(result) + '\n').encode('utf-8'))
+    finally:
+      slots.release()
+
+  try:
+    line_number = 0
+    async for line in read_lines(request.content, MAX_STREAM_LINE_SIZE):
+      line_number += 1
+      if line is not None:
+        line = line.strip()
+        if len(line) == 0:
+          continue
+
+      await slots.acquire()
+      task = asyncio.ensure_future(process_line(line_number, line))
+      tasks.add(task)
+      task.add_done_callback(tasks.discard)
+
+    if len(tasks) > 0:
+      await asyncio.gather(*tasks)
+  finally:
+    for task in list(tasks):
+      task.cancel()
+
+  await response.write_eof()
+  return response
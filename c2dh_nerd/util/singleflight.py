@@ -0,0 +1,29 @@
+import asyncio
+from typing import Callable, Awaitable, Any, Hashable
+
+class SingleFlight:
+  '''
+  Makes concurrent calls with the same key share one outstanding call.
+  The first caller starts `fn`, callers arriving before it completes
+  wait for the same result (or exception).
+  '''
+  def __init__(self):
+    self._calls = {}
+
+  async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+    future = self._calls.get(key)
+    if future is None:
+      future = asyncio.ensure_future(fn())
+      self._calls[key] = future
+
+      def forget(_):
+        if self._calls.get(key) is future:
+          del self._calls[key]
+      future.add_done_callback(forget)
+
+    # a cancelled caller must not cancel the call other callers are waiting for
+    return await asyncio.shield(future)
+
+  @property
+  def in_flight(self):
+    return len(self._calls)
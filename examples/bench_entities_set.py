@@ -0,0 +1,116 @@
+'''
+Compares the entities set names index with the Whoosh index it replaced.
+
+  python examples/bench_entities_set.py [number of entities]
+
+Whoosh (`pip install Whoosh==2.7.4`) is optional. Without it only the
+names index is measured.
+'''
+import sys
+import random
+import asyncio
+from timeit import default_timer as timer
+from c2dh_nerd.entities.set import EntitiesSet
+
+SYLLABLES = ['an', 'ber', 'cla', 'dor', 'el', 'fin', 'gus', 'har', 'ix', 'jul', 'ka', 'lux', 'mor', 'nor', 'ost', 'pe', 'qui', 'ros', 'sen', 'tal', 'ur', 'vil', 'wen', 'zo']
+HEADERS = ['name', 'alternative_names', 'type', 'description']
+N_QUERIES = 1000
+
+def random_word(rnd):
+  return ''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))).capitalize()
+
+def random_rows(n, rnd):
+  return [
+    [
+      ' '.join(random_word(rnd) for _ in range(rnd.randint(1, 3))),
+      '; '.join(random_word(rnd) for _ in range(rnd.randint(0, 2))),
+      rnd.choice(['PER', 'LOC', 'ORG']),
+      'Entity {}'.format(idx)
+    ]
+    for idx in range(n)
+  ]
+
+def misspell(word, rnd):
+  idx = rnd.randrange(len(word))
+  return word[:idx] + rnd.choice('aeiou') + word[idx + 1:]
+
+def random_queries(rows, rnd):
+  '''
+  Exact names, misspelled words of names with fuzzy terms
+  and fuzzy terms that must keep a prefix.
+  '''
+  names = [rnd.choice(rows)[0] for _ in range(N_QUERIES)]
+  return {
+    'exact': names,
+    'fuzzy': ['{}~'.format(misspell(rnd.choice(n.split()), rnd).lower()) for n in names],
+    'prefix': ['{}~2/3'.format(rnd.choice(n.split()).lower()) for n in names],
+  }
+
+def build_whoosh(rows):
+  from whoosh.filedb.filestore import RamStorage
+  from whoosh.fields import Schema, TEXT, ID
+  from whoosh.qparser import QueryParser, FuzzyTermPlugin
+
+  schema = Schema(name=TEXT(stored=False), alternative_names=TEXT(stored=False), id=ID(stored=True))
+  index = RamStorage().create_index(schema)
+  writer = index.writer()
+  for idx, row in enumerate(rows):
+    writer.add_document(name=row[0], alternative_names=row[1], id=str(idx))
+  writer.commit()
+
+  name_parser = QueryParser('name', schema)
+  name_parser.add_plugin(FuzzyTermPlugin())
+  alt_names_parser = QueryParser('alternative_names', schema)
+  alt_names_parser.add_plugin(FuzzyTermPlugin())
+  return index, name_parser, alt_names_parser
+
+def search_whoosh(whoosh, query, limit):
+  from whoosh import scoring
+  index, name_parser, alt_names_parser = whoosh
+  with index.searcher(weighting=scoring.Frequency) as searcher:
+    results = searcher.search(name_parser.parse(query) | alt_names_parser.parse(query), limit=limit)
+    return [int(r['id']) for r in results]
+
+def measure(label, fn, n = 1):
+  start = timer()
+  result = fn()
+  elapsed = timer() - start
+  print('{:<40} {:>10.3f} ms{}'.format(label, elapsed * 1000 / n, ' per call' if n > 1 else ''))
+  return result
+
+def main():
+  n_entities = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+  rnd = random.Random(42)
+  rows = random_rows(n_entities, rnd)
+  queries = random_queries(rows, rnd)
+  loop = asyncio.get_event_loop()
+
+  print('{} entities, {} queries of each kind'.format(n_entities, N_QUERIES))
+
+  entities_set = measure('names index: build', lambda: EntitiesSet('bench', HEADERS, rows))
+  names_results = {}
+  for kind, kind_queries in queries.items():
+    names_results[kind] = measure(
+      'names index: search ({})'.format(kind),
+      lambda: [[int(r.id) for r in loop.run_until_complete(entities_set.search(q, 10)).entities[0].resources] for q in kind_queries],
+      N_QUERIES
+    )
+
+  try:
+    import whoosh
+  except ImportError:
+    print('Whoosh is not installed, skipping comparison')
+    return
+
+  whoosh_index = measure('whoosh: build', lambda: build_whoosh(rows))
+  for kind, kind_queries in queries.items():
+    whoosh_results = measure(
+      'whoosh: search ({})'.format(kind),
+      lambda: [search_whoosh(whoosh_index, q, 10) for q in kind_queries],
+      N_QUERIES
+    )
+    different = sum(1 for a, b in zip(names_results[kind], whoosh_results) if a != b)
+    print('{} queries with different results: {}'.format(kind.capitalize(), different))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,67 @@
+'''
+Measures startup time and memory of lightweight configurations:
+importing the package and getting a NED that does not need any ML library.
+Every configuration runs in a fresh interpreter.
+
+  python examples/bench_startup.py [configuration ...]
+
+Configurations: import, ned_gkg, ned_custom_entities, ned_wikidata
+(needs `WIKIDATA_INDEX_PATH`) and, for comparison, ner_flair (needs
+flair and its model).
+'''
+import os
+import sys
+import json
+import subprocess
+
+HEAVY_MODULES = ['torch', 'flair', 'spacy', 'allennlp']
+
+CONFIGURATIONS = {
+  'import': '',
+  'ned_gkg': 'get_ned("gkg")',
+  'ned_custom_entities': 'get_ned("custom_entities")',
+  'ned_wikidata': 'get_ned("wikidata")',
+  'ner_flair': 'get_ner("flair")',
+}
+
+SCRIPT = '''
+import sys, json, time, resource
+started_at = time.time()
+from c2dh_nerd import get_ner, get_ned
+imported_at = time.time()
+{statement}
+done_at = time.time()
+print(json.dumps({{
+  'import_sec': imported_at - started_at,
+  'total_sec': done_at - started_at,
+  'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+  'heavy_modules': [m for m in {heavy_modules} if m in sys.modules],
+}}))
+'''
+
+def run(name):
+  script = SCRIPT.format(statement=CONFIGURATIONS[name], heavy_modules=repr(HEAVY_MODULES))
+  env = dict(os.environ)
+  env.setdefault('GKG_API_KEY', 'benchmark')
+  process = subprocess.run([sys.executable, '-c', script], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  if process.returncode != 0:
+    return None, process.stderr.decode('utf-8').strip().split('\n')[-1]
+  return json.loads(process.stdout.decode('utf-8').strip().split('\n')[-1]), None
+
+def main(names):
+  print('{:<22} {:>10} {:>10} {:>12}  {}'.format('configuration', 'import s', 'total s', 'max RSS MB', 'heavy modules loaded'))
+  for name in names:
+    result, error = run(name)
+    if result is None:
+      print('{:<22} failed: {}'.format(name, error))
+      continue
+    print('{:<22} {:>10.2f} {:>10.2f} {:>12.1f}  {}'.format(
+      name,
+      result['import_sec'],
+      result['total_sec'],
+      result['max_rss_mb'],
+      ', '.join(result['heavy_modules']) or '-'
+    ))
+
+if __name__ == '__main__':
+  main(sys.argv[1:] or [n for n in CONFIGURATIONS.keys() if n != 'ner_flair'])
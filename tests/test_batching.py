@@ -0,0 +1,33 @@
+import asyncio
+from c2dh_nerd.util.batching import MicroBatcher
+
+def run(coroutine):
+  return asyncio.get_event_loop().run_until_complete(coroutine)
+
+def test_micro_batcher():
+  batches = []
+  async def process(items):
+    batches.append(list(items))
+    return [i * 10 for i in items]
+
+  async def scenario():
+    batcher = MicroBatcher(process, max_batch_size = 3, max_wait_ms = 5)
+    return await asyncio.gather(
+      batcher.submit([1, 2]),
+      batcher.submit([3]),
+      batcher.submit([4]),
+      batcher.submit([]),
+    )
+
+  assert run(scenario()) == [[10, 20], [30], [40], []]
+  assert batches == [[1, 2, 3], [4]]
+
+def test_micro_batcher_failure():
+  async def process(items):
+    raise ValueError('failed')
+
+  async def scenario():
+    batcher = MicroBatcher(process, max_batch_size = 10, max_wait_ms = 1)
+    return await asyncio.gather(batcher.submit([1]), batcher.submit([2]), return_exceptions = True)
+
+  assert [str(r) for r in run(scenario())] == ['failed', 'failed']
@@ -0,0 +1,50 @@
+import time
+from diskcache import Cache
+from c2dh_nerd.util.cache import LruCache, TieredCache, MISSING
+
+def test_lru_cache_evicts_least_recently_used():
+  cache = LruCache(max_size = 3)
+  cache.set('a', 1)
+  cache.set('b', 2)
+  cache.set('c', 3)
+  assert cache.get('a') == 1
+  cache.set('d', 4)
+
+  assert cache.get('b') is MISSING
+  assert [cache.get(k) for k in 'acd'] == [1, 3, 4]
+
+  cache.set('big', 5, size = 4)
+  assert cache.get('big') is MISSING
+  cache.set('none', None)
+  assert cache.get('none') is None
+
+def test_lru_cache_expiration():
+  cache = LruCache(max_size = 10, ttl_sec = 60)
+  cache.set('a', 1)
+  cache.set('b', 2, expire_at = time.time() - 1)
+  assert cache.get('a') == 1
+  assert cache.get('b') is MISSING
+  assert cache.stats()['items'] == 1
+
+def test_tiered_cache(tmpdir):
+  disk = Cache(str(tmpdir))
+  parsed = []
+  def parse(serialized):
+    parsed.append(serialized)
+    return int(serialized)
+
+  cache = TieredCache(disk, LruCache(max_size = 100), expire_sec = 60)
+  cache.set('a', '1', 1)
+  assert cache.get('a', parse) == 1
+  assert parsed == []
+
+  other_process = TieredCache(disk, LruCache(max_size = 100))
+  assert other_process.get('a', parse) == 1
+  assert other_process.get('a', parse) == 1
+  assert parsed == ['1']
+
+  disk.set('b', '2')
+  values = other_process.get_many(['a', 'b', 'c'], parse)
+  assert values == { 'a': 1, 'b': 2, 'c': MISSING }
+  assert other_process.stats()['disk'] == { 'hits': 2, 'misses': 1 }
+  disk.close()
@@ -0,0 +1,36 @@
+from c2dh_nerd.entities.columns import ColumnsStore
+
+def test_columns_store():
+  store = ColumnsStore(3)
+  store.append(['a', 'b'])
+  store.append(['d', 'é', 'f', 'ignored'])
+
+  assert len(store) == 2
+  assert store[0] == ['a', 'b', '']
+  assert store[1] == ['d', 'é', 'f']
+  assert store.value(1, 1) == 'é'
+  assert store.padded(['x']) == ['x', '', '']
+
+  store[0] = ['x', 'y', 'z']
+  store[1] = None
+  assert list(store) == [['x', 'y', 'z'], None]
+  assert store.is_deleted(1)
+
+def test_columns_store_compact():
+  store = ColumnsStore(2)
+  for idx in range(10):
+    store.append([str(idx), 'value'])
+  size = store.size
+
+  for _ in range(5):
+    store[3] = ['3', 'changed value']
+  store[4] = None
+  assert store.dead_bytes > 0
+  assert store.needs_compaction
+
+  store.compact()
+  assert store.dead_bytes == 0
+  assert store.size == size - len('4value') + len('changed value') - len('value')
+  assert store[3] == ['3', 'changed value']
+  assert store[4] is None
+  assert store[9] == ['9', 'value']
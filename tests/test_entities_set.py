@@ -0,0 +1,136 @@
+import pickle
+import asyncio
+import pytest
+from c2dh_nerd.entities import set as set_module
+from c2dh_nerd.entities.set import EntitiesSet
+
+HEADERS = ['id', 'name', 'alternative_names', 'type', 'description']
+
+ROWS = [
+  ['1', 'Paris', 'Lutetia', 'LOC', 'Capital of France'],
+  ['2', 'Berlin', '', 'LOC', 'Capital of Germany'],
+  ['3', 'Angela Merkel', 'Merkel', 'PER', 'Chancellor'],
+]
+
+def run(coroutine):
+  return asyncio.get_event_loop().run_until_complete(coroutine)
+
+async def chunks(rows, size = 2):
+  for idx in range(0, len(rows), size):
+    yield rows[idx:idx + size]
+
+def search_ids(entities_set, query):
+  result = run(entities_set.search(query, 10))
+  return [r.id for r in result.entities[0].resources]
+
+def test_search_and_get():
+  entities_set = EntitiesSet('test', HEADERS, ROWS)
+
+  assert search_ids(entities_set, 'paris') == ['0']
+  assert search_ids(entities_set, 'merkel') == ['2']
+  assert entities_set.get_by_label('Angela Merkel').id == '2'
+
+  resource = entities_set.get_by_id('0')
+  assert resource.label == 'Paris'
+  assert resource.tag == 'LOC'
+  assert resource.description == 'Capital of France'
+  assert resource.metadata == { 'id': '1', 'alternative_names': ['Lutetia'] }
+  assert entities_set.get_by_id('3') is None
+  assert entities_set.get_by_id('x') is None
+
+def test_pickle():
+  entities_set = EntitiesSet('test', HEADERS, ROWS)
+  run(entities_set.scan('Paris', 5))
+
+  loaded = pickle.loads(pickle.dumps(entities_set))
+  assert search_ids(loaded, 'merkel') == ['2']
+  assert loaded.get_by_id('0').metadata['alternative_names'] == ['Lutetia']
+  assert [e.entity for e in run(loaded.scan('Paris and Berlin', 5)).entities] == ['Paris', 'Berlin']
+def test_update():
+  entities_set = EntitiesSet('test', HEADERS, ROWS)
+
+  new_rows = [
+    ['3', 'Angela Dorothea Merkel', 'Merkel', 'PER', 'Chancellor'],
+    ['1', 'Paris', 'Lutetia', 'LOC', 'Capital of France'],
+    ['4', 'Olaf Scholz', '', 'PER', ''],
+  ]
+  stats = run(entities_set.update(chunks(new_rows)))
+  assert stats == { 'added': 1, 'updated': 1, 'removed': 1 }
+
+  # IDs of rows that are kept do not change
+  assert entities_set.get_by_id('0').label == 'Paris'
+  assert entities_set.get_by_id('1') is None
+  assert entities_set.get_by_id('2').label == 'Angela Dorothea Merkel'
+  assert entities_set.get_by_id('3').label == 'Olaf Scholz'
+
+  assert search_ids(entities_set, 'berlin') == []
+  assert search_ids(entities_set, 'dorothea') == ['2']
+  assert search_ids(entities_set, 'scholz') == ['3']
+  # all terms of the label are in the new name
+  assert entities_set.get_by_label('Angela Merkel').id == '2'
+  assert entities_set.get_by_label('Berlin') is None
+
+  assert run(entities_set.update(chunks(new_rows))) == { 'added': 0, 'updated': 0, 'removed': 0 }
+
+def test_update_without_id_column():
+  headers = ['name', 'alternative_names', 'type']
+  entities_set = EntitiesSet('test', headers, [['Paris', '', 'LOC'], ['Paris', '', 'PER'], ['Rome', '', 'LOC']])
+
+  stats = run(entities_set.update(chunks([['Paris', '', 'LOC'], ['Paris', 'Paris Hilton', 'PER']])))
+  assert stats == { 'added': 0, 'updated': 1, 'removed': 1 }
+  assert entities_set.get_by_id('1').metadata['alternative_names'] == ['Paris Hilton']
+  assert entities_set.get_by_id('2') is None
+
+def test_update_with_colliding_key_hashes(monkeypatch):
+  monkeypatch.setattr(set_module, 'get_key_hash', lambda value, occurrence: 1)
+  entities_set = EntitiesSet('test', HEADERS, ROWS + [['1', 'Paris', '', 'LOC', 'Other Paris']])
+
+  new_rows = [
+    ['3', 'Angela Dorothea Merkel', 'Merkel', 'PER', 'Chancellor'],
+    ['1', 'Paris', 'Lutetia', 'LOC', 'Capital of France'],
+    ['4', 'Olaf Scholz', '', 'PER', ''],
+  ]
+  stats = run(entities_set.update(chunks(new_rows)))
+  assert stats == { 'added': 1, 'updated': 1, 'removed': 2 }
+  assert entities_set.get_by_id('0').label == 'Paris'
+  assert entities_set.get_by_id('2').label == 'Angela Dorothea Merkel'
+  assert entities_set.get_by_id('3') is None
+  assert entities_set.get_by_id('4').label == 'Olaf Scholz'
+
+def test_update_changes_scan():
+  entities_set = EntitiesSet('test', HEADERS, ROWS)
+  text = 'Olaf Scholz in Berlin'
+  assert [e.entity for e in run(entities_set.scan(text, 5)).entities] == ['Berlin']
+
+  run(entities_set.update(chunks(ROWS + [['4', 'Olaf Scholz', '', 'PER', '']])))
+  assert [e.entity for e in run(entities_set.scan(text, 5)).entities] == ['Olaf Scholz', 'Berlin']
+
+def test_not_updated_while_locked():
+  entities_set = EntitiesSet('test', HEADERS, ROWS)
+
+  async def scenario():
+    async with entities_set.lock:
+      update = asyncio.ensure_future(entities_set.update(chunks(ROWS + [['4', 'Olaf Scholz', '', 'PER', '']])))
+      await asyncio.sleep(0.01)
+      assert not update.done()
+      assert entities_set.get_by_id('3') is None
+    return await update
+
+  assert run(scenario()) == { 'added': 1, 'updated': 0, 'removed': 0 }
+  # the lock is not pickled
+  assert pickle.loads(pickle.dumps(entities_set)).get_by_id('3').label == 'Olaf Scholz'
+
+def test_failed_update_changes_nothing():
+  entities_set = EntitiesSet('test', HEADERS, ROWS)
+
+  async def failing_chunks():
+    yield [['1', 'Paris', '', 'LOC', 'Changed'], ['4', 'Olaf Scholz', '', 'PER', '']]
+    raise ConnectionResetError('download failed')
+
+  with pytest.raises(ConnectionResetError):
+    run(entities_set.update(failing_chunks()))
+
+  assert entities_set.get_by_id('0').description == 'Capital of France'
+  assert entities_set.get_by_id('1').label == 'Berlin'
+  assert entities_set.get_by_id('3') is None
+  assert search_ids(entities_set, 'scholz') == []
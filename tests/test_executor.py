@@ -0,0 +1,48 @@
+import time
+import asyncio
+import threading
+import pytest
+from c2dh_nerd.util.executor import InferenceExecutor, InferenceQueueFull
+
+def run(coroutine):
+  return asyncio.get_event_loop().run_until_complete(coroutine)
+
+def test_runs_outside_of_the_event_loop():
+  executor = InferenceExecutor(max_workers = 1)
+  assert run(executor.run(lambda a, b: a + b, 1, 2)) == 3
+  assert run(executor.run(threading.get_ident)) != threading.get_ident()
+  assert executor.pending == 0
+  executor.shutdown()
+
+def test_rejects_calls_beyond_the_queue():
+  executor = InferenceExecutor(max_workers = 1, max_queue_size = 1)
+
+  async def scenario():
+    return await asyncio.gather(*[executor.run(time.sleep, 0.01) for _ in range(3)], return_exceptions = True)
+
+  results = run(scenario())
+  assert results[:2] == [None, None]
+  assert isinstance(results[2], InferenceQueueFull)
+  assert executor.pending == 0
+  executor.shutdown()
+
+def test_event_loop_is_not_blocked():
+  executor = InferenceExecutor(max_workers = 1)
+  ticks = []
+
+  async def tick():
+    for _ in range(3):
+      ticks.append(time.monotonic())
+      await asyncio.sleep(0.005)
+
+  async def scenario():
+    await asyncio.gather(executor.run(time.sleep, 0.05), tick())
+
+  started_at = time.monotonic()
+  run(scenario())
+  assert ticks[-1] - started_at < 0.04
+  executor.shutdown()
+
+def test_unknown_kind():
+  with pytest.raises(AssertionError):
+    InferenceExecutor(kind = 'gpu')
@@ -0,0 +1,75 @@
+import asyncio
+from c2dh_nerd.entities.gazetteer import Gazetteer, tokenize_with_spans
+from c2dh_nerd.entities.set import EntitiesSet
+
+HEADERS = ['id', 'name', 'alternative_names', 'type']
+
+def scan(entities_set, text):
+  result = asyncio.get_event_loop().run_until_complete(entities_set.scan(text, 5))
+  return [(e.entity, e.matched_resource.label) for e in result.entities]
+
+def test_tokenize_with_spans_keeps_all_tokens():
+  assert tokenize_with_spans('The US, a state.') == [
+    ('the', 0, 3),
+    ('us', 4, 6),
+    ('a', 8, 9),
+    ('state', 10, 15),
+  ]
+
+def test_scan_leftmost_longest():
+  gazetteer = Gazetteer()
+  gazetteer.add('Bank of England', 1)
+  gazetteer.add('England', 2)
+  gazetteer.add('Bank', 3)
+
+  text = 'the BANK OF ENGLAND and England'
+  assert gazetteer.scan(text) == [(4, 19, [1]), (24, 31, [2])]
+
+def test_scan_orders_documents_by_priority():
+  gazetteer = Gazetteer()
+  gazetteer.add('Bob', 1, priority = 1)
+  gazetteer.add('bob', 2)
+
+  assert gazetteer.scan('Bob') == [(0, 3, [2, 1])]
+
+def test_scan_names_added_after_build():
+  gazetteer = Gazetteer()
+  gazetteer.add('Paris', 1)
+  assert gazetteer.scan('London and Paris') == [(11, 16, [1])]
+
+  gazetteer.add('London', 2)
+  assert gazetteer.scan('London and Paris') == [(0, 6, [2]), (11, 16, [1])]
+
+def test_scan_needs_all_tokens_of_a_name():
+  entities_set = EntitiesSet('test', HEADERS, [
+    ['1', 'The Who', '', 'ORG'],
+    ['2', 'Theresa May', '', 'PER'],
+    ['3', 'Bank of England', '', 'ORG'],
+    ['4', 'Will Smith', 'Willard Carroll Smith', 'PER'],
+    ['5', 'England', '', 'LOC'],
+  ])
+
+  text = 'Who knows? Theresa went to the bank in England. Smith said it.'
+  assert scan(entities_set, text) == [('England', 'England')]
+
+  text = 'The Who met Theresa May at the Bank of England with Willard Carroll Smith.'
+  assert scan(entities_set, text) == [
+    ('The Who', 'The Who'),
+    ('Theresa May', 'Theresa May'),
+    ('Bank of England', 'Bank of England'),
+    ('Willard Carroll Smith', 'Will Smith'),
+  ]
+
+def test_scan_short_names_and_stop_words():
+  entities_set = EntitiesSet('test', HEADERS, [
+    ['1', 'US', 'U.S.', 'LOC'],
+    ['2', 'IT', '', 'ORG'],
+    ['3', 'Malcolm X', '', 'PER'],
+  ])
+
+  text = 'Malcolm X left the U.S. while IT was down. Malcolm stayed.'
+  assert scan(entities_set, text) == [
+    ('Malcolm X', 'Malcolm X'),
+    ('U.S', 'US'),
+    ('IT', 'IT'),
+  ]
@@ -0,0 +1,48 @@
+import time
+import asyncio
+from c2dh_nerd.util.limiter import RateLimiter, parse_retry_after
+
+def run(coroutine):
+  return asyncio.get_event_loop().run_until_complete(coroutine)
+
+def test_parse_retry_after():
+  assert parse_retry_after(None) is None
+  assert parse_retry_after(' 120 ') == 120
+  assert parse_retry_after('soon') is None
+  assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+
+def test_rate_limiter_rate():
+  limiter = RateLimiter(rate_per_sec = 100, burst = 2)
+
+  async def call():
+    async with limiter:
+      return time.monotonic()
+
+  started_at = time.monotonic()
+  times = sorted(run(asyncio.gather(*[call() for _ in range(6)])))
+  # two calls right away, then one every 10ms
+  assert times[1] - started_at < 0.03
+  assert times[-1] - started_at >= 0.035
+  assert limiter.stats()['calls'] == 6
+
+def test_rate_limiter_in_flight():
+  limiter = RateLimiter(max_in_flight = 2)
+  in_flight = []
+
+  async def call():
+    async with limiter:
+      in_flight.append(limiter.in_flight)
+      await asyncio.sleep(0.005)
+
+  run(asyncio.gather(*[call() for _ in range(5)]))
+  assert max(in_flight) == 2
+  assert limiter.in_flight == 0
+
+def test_rate_limiter_retry_delay():
+  limiter = RateLimiter(backoff_base_sec = 1, backoff_max_sec = 5)
+  assert 0 <= limiter.retry_delay(0) <= 1
+  assert 0 <= limiter.retry_delay(10) <= 5
+  assert limiter.retry_delay(0, retry_after = 2) == 2
+  # long Retry-After values are capped
+  assert limiter.retry_delay(0, retry_after = 3600) == 5
+  assert limiter.stats()['throttled'] == 2
@@ -0,0 +1,62 @@
+import csv
+import io
+import asyncio
+import pytest
+from c2dh_nerd.entities.loader import CsvRowsParser, CsvDownload
+
+CSV = '''id,name,description
+1,Paris,"Capital, ""City of Light"""
+2,Berlin,"Capital
+of Germany"
+3,Zürich,
+'''
+
+def run(coroutine):
+  return asyncio.get_event_loop().run_until_complete(coroutine)
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 1000])
+def test_csv_rows_parser(chunk_size):
+  data = CSV.encode('utf-8')
+  parser = CsvRowsParser()
+  rows = []
+  for idx in range(0, len(data), chunk_size):
+    rows += parser.feed(data[idx:idx + chunk_size])
+  rows += parser.feed(b'', final = True)
+
+  assert rows == list(csv.reader(io.StringIO(CSV)))
+  assert rows[1] == ['1', 'Paris', 'Capital, "City of Light"']
+  assert rows[2] == ['2', 'Berlin', 'Capital\nof Germany']
+  assert rows[3] == ['3', 'Zürich', '']
+
+def test_csv_rows_parser_last_line_without_line_break():
+  parser = CsvRowsParser()
+  assert parser.feed(b'a,b\n1,2') == [['a', 'b']]
+  assert parser.feed(b'', final = True) == [['1', '2']]
+
+def test_csv_download_from_file(tmpdir):
+  path = tmpdir.join('entities.csv')
+  path.write_binary(CSV.encode('utf-8'))
+  url = 'file://{}'.format(path)
+
+  async def read(**kwargs):
+    async with CsvDownload(url, None, allow_files = True, **kwargs) as download:
+      if download.not_modified:
+        return download, None, None
+      headers = await download.read_headers()
+      rows = [r async for rows in download.row_chunks() for r in rows]
+      return download, headers, rows
+
+  download, headers, rows = run(read())
+  assert headers == ['id', 'name', 'description']
+  assert [r[1] for r in rows] == ['Paris', 'Berlin', 'Zürich']
+  assert download.rows_count == 4
+
+  download, _, _ = run(read(last_modified = download.last_modified))
+  assert download.not_modified
+
+  with pytest.raises(AssertionError):
+    run(read(max_rows = 2))
+
+def test_csv_download_files_not_allowed():
+  with pytest.raises(AssertionError):
+    run(CsvDownload('file:///etc/passwd', None).__aenter__())
@@ -0,0 +1,184 @@
+import pickle
+import pytest
+from c2dh_nerd.entities.index import NamesIndex, FuzzyTermsIndex, FUZZY_CONSTANT_SCORE_MAX_DOCS, tokenize, parse_query, edit_distance
+
+DOCUMENTS = [
+  ('Paris', 'Lutetia; City of Light'),
+  ('Paris Hilton', 'Paris Whitney Hilton'),
+  ('Berlin', ''),
+  ('Bank of England', 'Old Lady of Threadneedle Street'),
+  ('Barack Obama', 'Barack Hussein Obama II; Obama'),
+  ('Michelle Obama', 'Michelle LaVaughn Robinson Obama'),
+  ('Berlin Wall', 'Berliner Mauer'),
+  ('Luxembourg', 'Lëtzebuerg; Luxemburg'),
+]
+
+QUERIES = [
+  'Paris',
+  'paris hilton',
+  'Hilton',
+  'Obama',
+  'barack obama',
+  'Bank of England',
+  'the bank',
+  'Berlin',
+  'Berlni~',
+  'Berlni~2',
+  'obma~ michelle',
+  'luxemburg',
+  'Lëtzebuerg',
+  'Luxenbourg~/3',
+  'Luxenbourg~/5',
+  'hilten~1/2',
+  'Lady',
+  'nothing here',
+  'of the',
+]
+
+# fuzzy terms matching several terms, some of them repeated
+FUZZY_DOCUMENTS = [
+  ('Obama Obama Obamo', 'Obamma'),
+  ('Obamo', 'Obama'),
+  ('Obama', ''),
+  ('Osama', 'Obamas Obama'),
+]
+
+FUZZY_QUERIES = [
+  'obama~',
+  'obama~2',
+  'obama~ obamo~',
+  'obama~ obama',
+  'obma~',
+  'obamas~/5',
+  'obamo~1/4',
+]
+
+def create_index(documents):
+  index = NamesIndex()
+  for doc_id, (name, alternative_names) in enumerate(documents):
+    index.add(doc_id, name, alternative_names)
+  return index
+
+@pytest.fixture
+def index():
+  return create_index(DOCUMENTS)
+
+def ids(results):
+  return [doc_id for doc_id, _ in results]
+
+def test_tokenize_drops_stop_words_and_single_letters():
+  assert tokenize('The Bank of England, U.S.A. & X') == ['bank', 'england', 'u.s.a']
+
+def test_parse_query():
+  assert parse_query('the Bank~ england~2/1') == [
+    ('fuzzy', 'bank', 1, 0),
+    ('fuzzy', 'england', 2, 1),
+  ]
+  assert parse_query('bank~', allow_fuzzy = False) == [('term', 'bank')]
+
+def test_edit_distance():
+  assert edit_distance('berlin', 'berlni', 2) == 2
+  assert edit_distance('berlin', 'berlin', 0) == 0
+  assert edit_distance('berlin', 'paris', 1) == 2
+
+def test_fuzzy_terms_index():
+  terms = FuzzyTermsIndex(['berlin', 'berliner', 'bern', 'paris'])
+  assert terms.similar('berlni', 2) == set(['berlin', 'bern'])
+  assert terms.similar('berlni', 1) == set()
+  assert terms.similar('bern', 1) == set(['bern'])
+  assert terms.similar('berlin', 2) == set(['berlin', 'berliner', 'bern'])
+  assert terms.similar('berlin', 2, prefix_length = 5) == set(['berlin', 'berliner'])
+
+def test_search_all_terms_in_one_field(index):
+  assert ids(index.search('Paris', 10)) == [1, 0]
+  assert ids(index.search('paris hilton', 10)) == [1]
+  assert ids(index.search('Obama', 10)) == [4, 5]
+  # "barack" only in the name, "hussein" only in alternative names
+  assert ids(index.search('barack hussein', 10)) == [4]
+  assert ids(index.search('michelle hussein', 10)) == []
+  assert ids(index.search('Lady', 10)) == [3]
+  assert ids(index.search('nothing here', 10)) == []
+  assert ids(index.search('of the', 10)) == []
+
+def test_search_scores_frequencies(index):
+  assert index.search('Obama', 10) == [(4, 3), (5, 2)]
+  assert index.search('Paris', 1) == [(1, 2)]
+
+def test_search_fuzzy(index):
+  assert ids(index.search('Berlni~', 10)) == []
+  assert ids(index.search('Berlni~2', 10)) == [2, 6]
+  assert ids(index.search('obma~ michelle', 10)) == [5]
+  assert ids(index.search('Luxenbourg~/3', 10)) == [7]
+  assert ids(index.search('Luxenbourg~/5', 10)) == []
+
+def test_search_fuzzy_scores():
+  index = create_index(FUZZY_DOCUMENTS)
+  # "obama", "obamo" and "osama" names, constant scores
+  assert index.search('obama~', 10) == [(0, 2), (1, 2), (3, 2), (2, 1)]
+  # "obama" and "obamo" names, sum of frequencies
+  assert index.search('obamo~1/4', 10) == [(0, 3), (1, 2), (2, 1), (3, 1)]
+
+  for doc_id in range(len(FUZZY_DOCUMENTS), FUZZY_CONSTANT_SCORE_MAX_DOCS + 1):
+    index.add(doc_id, 'Doc {}'.format(doc_id), '')
+  assert index.search('obama~', 4) == [(0, 4), (3, 3), (1, 2), (2, 1)]
+
+def test_get_by_name(index):
+  assert index.get_by_name('the Bank of England') == 3
+  assert index.get_by_name('Berlin') == 2
+  assert index.get_by_name('Wall') == 6
+  assert index.get_by_name('Robinson') is None
+
+def test_remove(index):
+  index.remove(1, *DOCUMENTS[1])
+  assert ids(index.search('Paris', 10)) == [0]
+  assert ids(index.search('hilton', 10)) == []
+  assert index.get_by_name('Paris Hilton') is None
+
+  index.add(1, 'Paris Hilton', '')
+  assert ids(index.search('hilton', 10)) == [1]
+
+def test_fuzzy_terms_follow_changes(index):
+  assert ids(index.search('Berlni~2', 10)) == [2, 6]
+  index.add(8, 'Bernin', '')
+  assert ids(index.search('Berlni~2', 10)) == [2, 6, 8]
+
+def test_pickle(index):
+  assert ids(index.search('Berlni~2', 10)) == [2, 6]
+  loaded = pickle.loads(pickle.dumps(index))
+  assert ids(loaded.search('Berlni~2', 10)) == [2, 6]
+  assert loaded.get_by_name('Barack Obama') == 4
+
+def search_whoosh(documents, query):
+  from whoosh import scoring
+  from whoosh.filedb.filestore import RamStorage
+  from whoosh.fields import Schema, TEXT, ID
+  from whoosh.qparser import QueryParser, FuzzyTermPlugin
+
+  # the way entities sets were indexed with Whoosh
+  schema = Schema(name=TEXT(stored=False), alternative_names=TEXT(stored=False), id=ID(stored=True))
+  whoosh_index = RamStorage().create_index(schema)
+  writer = whoosh_index.writer()
+  for doc_id, (name, alternative_names) in enumerate(documents):
+    writer.add_document(name=name, alternative_names=alternative_names, id=str(doc_id))
+  writer.commit()
+
+  parsers = []
+  for field in ['name', 'alternative_names']:
+    parser = QueryParser(field, schema)
+    parser.add_plugin(FuzzyTermPlugin())
+    parsers.append(parser)
+
+  with whoosh_index.searcher(weighting=scoring.Frequency) as searcher:
+    whoosh_query = parsers[0].parse(query) | parsers[1].parse(query)
+    return {int(hit['id']): hit.score for hit in searcher.search(whoosh_query, limit=None)}
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_search_matches_whoosh(index, query):
+  pytest.importorskip('whoosh')
+  assert dict(index.search(query, len(DOCUMENTS))) == search_whoosh(DOCUMENTS, query)
+
+@pytest.mark.parametrize('query', FUZZY_QUERIES)
+def test_fuzzy_search_matches_whoosh(query):
+  pytest.importorskip('whoosh')
+  index = create_index(FUZZY_DOCUMENTS)
+  assert dict(index.search(query, len(FUZZY_DOCUMENTS))) == search_whoosh(FUZZY_DOCUMENTS, query)
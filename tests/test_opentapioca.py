@@ -0,0 +1,59 @@
+import asyncio
+from c2dh_nerd.ned.opentapioca import OpenTapiocaNed, pack_texts, split_annotations, TEXTS_SEPARATOR
+
+def annotation(query, surface_form, occurrence = 0):
+  start = -1
+  for _ in range(occurrence + 1):
+    start = query.index(surface_form, start + 1)
+  return {
+    'start': start,
+    'end': start + len(surface_form),
+    'log_likelihood': -1.0,
+    'tags': [{ 'id': 'Q{}'.format(len(surface_form)), 'rank': 1.0, 'label': [surface_form], 'desc': '', 'types': { 'Q5': True } }]
+  }
+
+def test_pack_texts():
+  query, starts = pack_texts(['Paris', 'Rome', 'Berlin'])
+  assert query == TEXTS_SEPARATOR.join(['Paris', 'Rome', 'Berlin'])
+  assert [query[s:s + len(t)] for s, t in zip(starts, ['Paris', 'Rome', 'Berlin'])] == ['Paris', 'Rome', 'Berlin']
+
+def test_split_annotations():
+  texts = ['Paris Hilton', 'Rome', 'in Paris']
+  query, starts = pack_texts(texts)
+  annotations = [
+    annotation(query, 'Paris Hilton'),
+    annotation(query, 'Rome'),
+    annotation(query, 'Paris', 1),
+  ]
+
+  split = split_annotations(annotations, texts, starts)
+  assert [[(a['start'], a['end']) for a in text_annotations] for text_annotations in split] == [[(0, 12)], [(0, 4)], [(3, 8)]]
+  assert [texts[2][a['start']:a['end']] for a in split[2]] == ['Paris']
+
+def test_split_annotations_drops_annotations_across_texts():
+  texts = ['New', 'York']
+  query, starts = pack_texts(texts)
+  annotations = [annotation(query, query)]
+  assert split_annotations(annotations, texts, starts) == [[], []]
+
+class StubOpenTapiocaNed(OpenTapiocaNed):
+  def __init__(self, surface_forms):
+    super().__init__(http_client = object())
+    self.surface_forms = surface_forms
+    self.queries = []
+
+  async def get_opentapioca_response(self, text):
+    self.queries.append(text)
+    return { 'annotations': [annotation(text, s) for s in self.surface_forms if s in text] }
+
+def test_extract_many_annotates_texts_together():
+  ned = StubOpenTapiocaNed(['Rome', 'Hilton'])
+  results = asyncio.get_event_loop().run_until_complete(ned.extract_many(['Paris Hilton', 'Rome', '', 'Rome']))
+
+  assert ned.queries == [TEXTS_SEPARATOR.join(['Paris Hilton', 'Rome'])]
+  assert [[(e.entity, e.left, e.right) for e in r.entities] for r in results] == [
+    [('Hilton', 6, 12)],
+    [('Rome', 0, 4)],
+    [],
+    [('Rome', 0, 4)],
+  ]
@@ -0,0 +1,80 @@
+import time
+import asyncio
+import pytest
+from c2dh_nerd.util.registry import ModelRegistry
+
+def run(coroutine):
+  return asyncio.get_event_loop().run_until_complete(coroutine)
+
+class Model:
+  def __init__(self, name, memory_size = None, dependencies = ()):
+    self.name = name
+    self.memory_size = memory_size
+    self.dependencies = dependencies
+    self.closed = False
+
+  def close(self):
+    self.closed = True
+
+def test_registry_creates_instances_once():
+  registry = ModelRegistry()
+  created = []
+  registry.register('a', lambda: created.append(1) or Model('a'))
+
+  assert 'a' in registry
+  assert not registry.is_loaded('a')
+  assert registry.get('a') is registry.get('a')
+  assert run(registry.load('a')) is registry.get('a')
+  assert created == [1]
+  with pytest.raises(AssertionError):
+    registry.get('unknown')
+
+def test_registry_memory_budget():
+  registry = ModelRegistry(memory_budget = 250)
+  models = {}
+  for tag in 'abc':
+    registry.register(tag, lambda tag=tag: models.setdefault(tag, Model(tag, memory_size = 100)), evictable = True)
+  registry.register('fixed', lambda: Model('fixed', memory_size = 1000))
+
+  registry.get('fixed')
+  registry.get('a')
+  registry.get('b')
+  registry.get('a')
+  registry.get('c')
+
+  # "b" is the least recently used
+  assert [registry.is_loaded(t) for t in ['fixed', 'a', 'b', 'c']] == [True, True, False, True]
+  assert models['b'].closed
+  assert registry.used_memory == 200
+  assert registry.stats()['models']['b']['evictions'] == 1
+
+def test_registry_dependencies():
+  registry = ModelRegistry(memory_budget = 150)
+  registry.register('ner', lambda: Model('ner', memory_size = 100), evictable = True)
+  registry.register('fusion', lambda: Model('fusion', memory_size = 10, dependencies = [registry.get('ner')]), evictable = True)
+  registry.register('other', lambda: Model('other', memory_size = 100), evictable = True)
+
+  registry.get('fusion')
+  assert registry.is_loaded('ner')
+
+  # evicting the NER evicts the fusion NED using it
+  registry.get('other')
+  assert not registry.is_loaded('ner')
+  assert not registry.is_loaded('fusion')
+
+  registry.get('fusion')
+  registry.pin('fusion')
+  registry.get('other')
+  assert registry.is_loaded('ner')
+  assert registry.is_loaded('fusion')
+
+def test_registry_idle_ttl():
+  registry = ModelRegistry(idle_ttl_sec = 0.01)
+  registry.register('a', lambda: Model('a', memory_size = 1), evictable = True)
+  registry.register('b', lambda: Model('b', memory_size = 1), evictable = True)
+
+  registry.get('a')
+  time.sleep(0.02)
+  registry.get('b')
+  assert not registry.is_loaded('a')
+  assert registry.is_loaded('b')
@@ -0,0 +1,61 @@
+import json
+import asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+from c2dh_nerd.util import routes
+from c2dh_nerd.util.routes import read_lines, stream_documents
+
+def run(coroutine):
+  return asyncio.get_event_loop().run_until_complete(coroutine)
+
+class Content:
+  def __init__(self, data, chunk_size):
+    self.data = data
+    self.chunk_size = chunk_size
+
+  async def iter_chunked(self, _):
+    for idx in range(0, len(self.data), self.chunk_size):
+      yield self.data[idx:idx + self.chunk_size]
+
+def lines(data, chunk_size, max_line_size = 5):
+  async def read():
+    return [line async for line in read_lines(Content(data, chunk_size), max_line_size)]
+  return run(read())
+
+def test_read_lines():
+  data = b'a\nbcd\n\nefghij\nklmnopq\nrs'
+  for chunk_size in [1, 2, 3, 100]:
+    assert lines(data, chunk_size) == [b'a', b'bcd', b'', None, None, b'rs']
+
+  assert lines(b'abc\n', 2) == [b'abc']
+  assert lines(b'abcdefgh', 3) == [None]
+  assert lines(b'abcde', 3) == [b'abcde']
+
+def test_stream_documents(monkeypatch):
+  monkeypatch.setattr(routes, 'MAX_STREAM_LINE_SIZE', 50)
+
+  async def extract(text):
+    return text.upper()
+
+  async def handler(request):
+    return await stream_documents(request, extract)
+
+  async def scenario():
+    app = web.Application()
+    app.router.add_post('/stream', handler)
+    async with TestClient(TestServer(app)) as client:
+      body = '\n'.join([
+        json.dumps({ 'id': 1, 'text': 'paris' }),
+        'not json',
+        json.dumps({ 'id': 2, 'text': 'x' * 100 }),
+        '',
+        json.dumps({ 'id': 3 }),
+      ]).encode('utf-8') + b'\n\xff\n'
+      response = await client.post('/stream', data = body)
+      return [json.loads(line) for line in (await response.text()).splitlines()]
+
+  results = sorted(run(scenario()), key = lambda r: (r.get('line', 0), r['id'] or 0))
+  assert results[0] == { 'id': 1, 'result': 'PARIS' }
+  assert results[1] == { 'id': 3, 'error': '"text" must be provided' }
+  assert [r['line'] for r in results[2:]] == [2, 3, 6]
+  assert results[3]['error'] == 'Line is longer than 50 bytes'
@@ -0,0 +1,38 @@
+import asyncio
+from c2dh_nerd.util.singleflight import SingleFlight
+
+def run(coroutine):
+  return asyncio.get_event_loop().run_until_complete(coroutine)
+
+def test_single_flight_shares_calls():
+  calls = []
+  async def fetch(value):
+    calls.append(value)
+    await asyncio.sleep(0.01)
+    return value
+
+  async def scenario():
+    flight = SingleFlight()
+    results = await asyncio.gather(
+      flight.run('a', lambda: fetch(1)),
+      flight.run('a', lambda: fetch(2)),
+      flight.run('b', lambda: fetch(3)),
+    )
+    assert flight.in_flight == 0
+    # finished calls are not remembered
+    results.append(await flight.run('a', lambda: fetch(4)))
+    return results
+
+  assert run(scenario()) == [1, 1, 3, 4]
+  assert calls == [1, 3, 4]
+
+def test_single_flight_cancelled_caller():
+  async def scenario():
+    flight = SingleFlight()
+    first = asyncio.ensure_future(flight.run('a', lambda: asyncio.sleep(0.01, result = 'done')))
+    second = asyncio.ensure_future(flight.run('a', lambda: asyncio.sleep(0.01, result = 'other')))
+    await asyncio.sleep(0)
+    first.cancel()
+    return await second
+
+  assert run(scenario()) == 'done'
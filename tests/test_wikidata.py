@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+from c2dh_nerd.ned.wikidata import build_index, WikidataIndex, WikidataNed, MAGIC
+
+EXTRACT = '''\
+Q264766\tTheresa May\tTheresa Mary May\tBritish politician\tQ5\t100
+Q1\tTheresa\t\tgiven name\tQ202444\t5
+Q40096\tWill Smith\tWillard Carroll Smith\tAmerican actor\tQ5\t120
+Q2\tSmith\t\tfamily name\tQ101352\t50
+Q43303\tMalcolm X\tEl-Hajj Malik El-Shabazz\tAmerican activist\tQ5\t90
+Q3\tMalcolm\t\tgiven name\tQ202444\t40
+Q30\tUnited States of America\tUS|U.S.|USA\tcountry\tQ6256,Q43229\t500
+Q4\tUS\t\tdisambiguation page\tQ4167410\t1
+Q119\tMay\t\tmonth of the year\tQ47018901\t80
+Q5\tMay\tMay Brown\tfictional character\tQ5\t10
+Q6\tIT\t\tinformation technology\tQ11862829\t70
+not a record
+'''
+
+@pytest.fixture
+def index_path(tmpdir):
+  extract_path = str(tmpdir.join('extract.tsv'))
+  index_path = str(tmpdir.join('wikidata.idx'))
+  with open(extract_path, 'w', encoding='utf-8') as f:
+    f.write(EXTRACT)
+  build_index(extract_path, index_path)
+  return index_path
+
+def ids(records):
+  return [r[0] for r in records]
+
+def test_index_header(index_path):
+  index = WikidataIndex(index_path)
+  assert index.entities_count == 11
+  with open(index_path, 'rb') as f:
+    assert f.read(len(MAGIC)) == MAGIC
+
+def test_get_by_name_needs_every_word(index_path):
+  index = WikidataIndex(index_path)
+  assert ids(index.get_by_name('Theresa May', 10)) == ['Q264766']
+  assert ids(index.get_by_name('theresa', 10)) == ['Q1']
+  assert ids(index.get_by_name('Will Smith', 10)) == ['Q40096']
+  assert ids(index.get_by_name('Malcolm X', 10)) == ['Q43303']
+  assert ids(index.get_by_name('Malcolm', 10)) == ['Q3']
+  assert ids(index.get_by_name('Bank of England', 10)) == []
+  assert ids(index.get_by_name('', 10)) == []
+
+def test_get_by_name_short_and_stop_words(index_path):
+  index = WikidataIndex(index_path)
+  assert ids(index.get_by_name('US', 10)) == ['Q30', 'Q4']
+  assert ids(index.get_by_name('u.s.', 10)) == ['Q30']
+  assert ids(index.get_by_name('IT', 10)) == ['Q6']
+  assert ids(index.get_by_name('May', 10)) == ['Q119', 'Q5']
+  assert ids(index.get_by_name('May', 1)) == ['Q119']
+
+def test_get_by_name_ignores_case_and_spacing(index_path):
+  index = WikidataIndex(index_path)
+  assert ids(index.get_by_name('  willard  CARROLL smith ', 10)) == ['Q40096']
+
+def test_get_by_id(index_path):
+  index = WikidataIndex(index_path)
+  assert index.get_by_id('Q43303') == ['Q43303', 'Malcolm X', 'American activist', 'PER', '90.0']
+  assert index.get_by_id('Q30')[3] == 'ORG'
+  assert index.get_by_id('Q999') is None
+
+def test_ned(index_path):
+  ned = WikidataNed(index_path)
+  loop = asyncio.get_event_loop()
+
+  result = loop.run_until_complete(ned.extract('Theresa May'))
+  assert result.entities[0].matched_resource.id == 'Q264766'
+  assert result.entities[0].matched_resource.tag == 'PER'
+
+  resource = loop.run_until_complete(ned.expand_resource('wikidata', 'Q999', label = 'Malcolm X'))
+  assert resource.id == 'Q43303'